@@ -0,0 +1,168 @@
+"""asyncio send path built on Twilio's async HTTP client
+
+One event loop can keep thousands of sends in flight without an OS thread
+per message.  A semaphore caps the number of concurrent requests.
+
+Usage:
+    async with AsyncSender(account_sid, auth_token) as sender:
+        sid = await sender.send_one("+1234567890", "Hello!")
+        async for result in sender.send(messages):
+            ...
+"""
+
+import asyncio
+import os
+import time
+
+from messaging import create_message_async, find_sent_message_async
+from metrics import track_send
+from profiling import traced
+from bulk_sender import SendResult, resend_check_since
+from retry import call_with_retry_async, may_have_been_sent
+from sender_pool import SenderPool
+from transport import build_async_client
+
+# Default cap on concurrent in-flight requests
+DEFAULT_MAX_IN_FLIGHT = int(os.getenv("ASYNC_MAX_IN_FLIGHT", "100"))
+
+
+class AsyncSender:
+    """Send messages concurrently from one event loop with a bounded number in flight"""
+
+    def __init__(self, account_sid, auth_token, from_=None,
+                 max_in_flight=DEFAULT_MAX_IN_FLIGHT, rate_limiter=None, retry_policy=None,
+                 sender_pool=None, suppression=None, status_callback=None):
+        self.account_sid = account_sid
+        self.suppression = suppression
+        # Twilio POSTs delivery status changes here when set
+        self._create_options = {"status_callback": status_callback} if status_callback else {}
+        self.auth_token = auth_token
+        self.max_in_flight = max(1, int(max_in_flight))
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.sender_pool = sender_pool or SenderPool([from_] if from_ else None,
+                                                     rate_limiter=rate_limiter)
+        self.client = None
+        self._semaphore = None
+
+    async def open(self):
+        """Create the async client and semaphore on the running loop"""
+        if self.client is None:
+            # One pooled connection per request allowed in flight
+            self.client = build_async_client(self.account_sid, self.auth_token,
+                                             pool_size=self.max_in_flight)
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self
+
+    async def close(self):
+        """Close the underlying aiohttp session"""
+        if self.client is not None:
+            await self.client.http_client.close()
+            self.client = None
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def _create(self, recipient, body, from_):
+        if self.rate_limiter is None:
+            return await self._create_in_flight(recipient, body, from_)
+        # The rate-limit wait happens before a slot is taken, so max_in_flight
+        # counts requests on the wire, not sends waiting for their turn
+        return await self.rate_limiter.call_async(from_, self._create_in_flight,
+                                                  recipient, body, from_)
+
+    async def _create_in_flight(self, recipient, body, from_):
+        async with self._semaphore:
+            return await create_message_async(self.client, recipient, body, from_=from_,
+                                              **self._create_options)
+
+    async def _find_sent(self, recipient, body, since):
+        async with self._semaphore:
+            return await find_sent_message_async(self.client, recipient, body, since)
+
+    @traced("async_sender.send_one")
+    async def send_one(self, recipient, body, from_=None, sent_since=None):
+        """Send a single message and return its SID
+
+        sent_since works as in BulkSender.send_one: Twilio is checked for a
+        copy sent by an earlier, unconfirmed attempt before sending again.
+        """
+        with track_send():
+            await self.open()
+            if self.suppression is not None:
+                self.suppression.check(recipient)
+            from_ = from_ or self.sender_pool.select(recipient)
+            unsure_since = [sent_since]
+
+            async def create_once():
+                if unsure_since[0] is not None:
+                    sid = await self._find_sent(recipient, body, unsure_since[0])
+                    if sid is not None:
+                        return sid
+                started = time.time()
+                try:
+                    return (await self._create(recipient, body, from_)).sid
+                except Exception as e:
+                    if unsure_since[0] is None and may_have_been_sent(e):
+                        unsure_since[0] = started
+                    raise
+
+            with self.sender_pool.sending(from_):
+                if self.retry_policy is None:
+                    return await create_once()
+                # Backoff sleeps happen outside the semaphore so they do not hold a slot
+                return await call_with_retry_async(self.retry_policy, create_once)
+
+    async def _run(self, index, recipient, body, from_, sent_since=None):
+        try:
+            return SendResult(index, recipient, True,
+                              await self.send_one(recipient, body, from_, sent_since))
+        except Exception as e:
+            return SendResult(index, recipient, False, str(e))
+
+    async def _send(self, jobs):
+        await self.open()
+        window = self.max_in_flight * 2
+        pending = set()
+
+        for job in jobs:
+            pending.add(asyncio.ensure_future(self._run(*job)))
+            if len(pending) >= window:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+
+    def send(self, messages):
+        """Send (recipient, body) pairs, yielding a SendResult as each one finishes
+
+        Only ``2 * max_in_flight`` tasks exist at once, so very large
+        campaigns do not create one task per message up front.
+        """
+        jobs = ((index, recipient, body, None) for index, (recipient, body) in enumerate(messages))
+        return self._send(jobs)
+
+    async def send_outbox(self, outbox, batch_size=500):
+        """Drain due messages from the outbox, yielding a SendResult per message
+
+        SendResult.index is the outbox message id.
+        """
+        jobs = ((message.id, message.recipient, message.body, message.from_number,
+                 resend_check_since(message))
+                for message in outbox.claim_batches(batch_size))
+        try:
+            async for result in self._send(jobs):
+                if result.success:
+                    outbox.mark_sent(result.index, result.result)
+                else:
+                    outbox.mark_failed(result.index, result.result)
+                yield result
+        finally:
+            outbox.flush()
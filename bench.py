@@ -0,0 +1,496 @@
+"""Throughput and latency benchmark of the send paths against the fake API
+
+    python bench.py                                   # every scenario at 1, 8 and 32
+    python bench.py --scenarios bulk,async --concurrency 16,64,256 --messages 2000
+    python bench.py --latency lognormal:0.15,0.35 --errors 429:0.01 --output before.json
+    python bench.py --startup                         # time to the CLI's first prompt and GUI's first frame
+
+Scenarios:
+    cli    main.send_whatsapp_message called from N threads
+    gui    WhatsAppGUI.send_whatsapp_message (the window's send path, no widgets) from N threads
+    bulk   BulkSender.send with N workers
+    async  AsyncSender.send with N requests in flight (its latency includes
+           waiting for a slot, since it starts more tasks than it lets send)
+
+fake_twilio.py runs in its own process, and every scenario/concurrency
+pair runs in a fresh process with a throwaway outbox, so module-level
+state, CPU time and peak RSS are not shared between runs.  Rate limiting
+is lifted (--rate 0) so the numbers reflect the send path itself.
+
+Each run reports messages/second, p50/p95/p99 latency per message, CPU
+milliseconds per message (all threads of the run's process) and peak
+RSS.  Results are also written as JSON for comparing releases.
+
+--startup instead starts the CLI and the GUI --runs times each, every
+start a fresh process, and reports the time until the CLI prints its
+first prompt and the GUI reports its first frame, next to the time a bare
+interpreter takes to start and exit.  For the GUI it also times building
+each section it defers until first use (the date/time picker and the
+recurrence input), which is the time kept off the first frame.  The GUI
+needs a display.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+SCENARIOS = ("cli", "gui", "bulk", "async")
+
+# Defaults chosen so a full run finishes in about a minute
+DEFAULT_CONCURRENCY = "1,8,32"
+DEFAULT_MESSAGES = 300
+DEFAULT_LATENCY = "constant:0.05"
+DEFAULT_OUTPUT = "bench_results.json"
+
+# Startup targets: script run and the output that shows it is ready for the user
+STARTUP_TARGETS = {"cli": ("main.py", b"Enter the recipient's name"),
+                   "gui": ("gui_main.py", b"Window ready")}
+DEFAULT_STARTUP_RUNS = 20
+
+# Sections the GUI builds the first time they are chosen, and the schedule choice showing each
+DEFERRED_SECTIONS = (("datetime_picker", "schedule"), ("recurring_input", "recurring"))
+DEFERRED_SECTION_RUNS = 5
+
+# Placeholder credentials; the fake API accepts any token when started without one
+BENCH_ACCOUNT_SID = "AC" + "0" * 32
+BENCH_AUTH_TOKEN = "bench"
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None  # Windows
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def _recipients(count):
+    return [f"+1555{i:07d}" for i in range(count)]
+
+
+def _call_concurrently(send, recipients, concurrency):
+    """Call send(recipient) from concurrency threads; return (latencies, failures)"""
+    latencies = []
+    failures = [0]
+
+    def timed(recipient):
+        started = time.perf_counter()
+        try:
+            ok = send(recipient)
+        except Exception:
+            ok = False
+        latencies.append(time.perf_counter() - started)
+        if ok is False:
+            failures[0] += 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, recipients))
+    return latencies, failures[0]
+
+
+# Each _prepare_* function does the imports and setup outside the measured
+# time and returns run(recipients) -> (latencies, failures)
+
+def _prepare_cli(concurrency):
+    import main
+
+    # The CLI builds its client and sender on the first send; keep that out of the timings
+    main.get_sender()
+
+    def send(recipient):
+        return main.send_whatsapp_message(recipient, "Benchmark message")
+    return lambda recipients: _call_concurrently(send, recipients, concurrency)
+
+
+def _prepare_gui(concurrency):
+    from gui_main import WhatsAppGUI
+    from outbox import Outbox
+    from rate_limiter import AdaptiveRateLimiter
+    from retry import RetryPolicy
+    from sender_pool import SenderPool
+    from suppression import SuppressionList
+    from transport import DEFAULT_MAX_WORKERS, build_client
+
+    # The window's send path needs these attributes, not the widgets
+    gui = WhatsAppGUI.__new__(WhatsAppGUI)
+    gui.account_sid, gui.auth_token = BENCH_ACCOUNT_SID, BENCH_AUTH_TOKEN
+    gui.client = build_client(gui.account_sid, gui.auth_token, pool_size=DEFAULT_MAX_WORKERS)
+    gui.rate_limiter = AdaptiveRateLimiter()
+    gui.sender_pool = SenderPool(rate_limiter=gui.rate_limiter)
+    gui.suppression = SuppressionList()
+    gui.retry_policy = RetryPolicy()
+    gui.outbox = Outbox()
+
+    def send(recipient):
+        success, _ = gui.send_whatsapp_message(recipient, "Benchmark message")
+        return success
+    return lambda recipients: _call_concurrently(send, recipients, concurrency)
+
+
+def _prepare_bulk(concurrency):
+    from bulk_sender import BulkSender
+    from rate_limiter import AdaptiveRateLimiter
+    from transport import build_client
+
+    latencies = []
+
+    class TimedSender(BulkSender):
+        def send_one(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return super().send_one(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - started)
+
+    client = build_client(BENCH_ACCOUNT_SID, BENCH_AUTH_TOKEN, pool_size=concurrency)
+    sender = TimedSender(client, max_workers=concurrency, rate_limiter=AdaptiveRateLimiter())
+
+    def run(recipients):
+        results = list(sender.send((recipient, "Benchmark message") for recipient in recipients))
+        return latencies, sum(1 for result in results if not result.success)
+    return run
+
+
+def _prepare_async(concurrency):
+    import asyncio
+    from async_sender import AsyncSender
+    from rate_limiter import AdaptiveRateLimiter
+
+    latencies = []
+
+    class TimedSender(AsyncSender):
+        async def send_one(self, *args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await super().send_one(*args, **kwargs)
+            finally:
+                latencies.append(time.perf_counter() - started)
+
+    async def send_all(recipients):
+        async with TimedSender(BENCH_ACCOUNT_SID, BENCH_AUTH_TOKEN, max_in_flight=concurrency,
+                               rate_limiter=AdaptiveRateLimiter()) as sender:
+            return [result async for result in
+                    sender.send((recipient, "Benchmark message") for recipient in recipients)]
+
+    def run(recipients):
+        results = asyncio.run(send_all(recipients))
+        return latencies, sum(1 for result in results if not result.success)
+    return run
+
+
+_PREPARE = {"cli": _prepare_cli, "gui": _prepare_gui, "bulk": _prepare_bulk,
+            "async": _prepare_async}
+
+
+def run_scenario(scenario, messages, concurrency):
+    """Run one scenario in this process and return its measurements"""
+    recipients = _recipients(messages)
+    # The CLI and GUI print or log every send; keep that out of the measurements' output
+    with contextlib.redirect_stdout(io.StringIO()):
+        run = _PREPARE[scenario](concurrency)
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        latencies, failures = run(recipients)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+    ordered = sorted(latencies)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "messages": messages,
+        "failures": failures,
+        "seconds": round(elapsed, 3),
+        "messages_per_second": round(messages / elapsed, 1),
+        "p50_ms": round(_percentile(ordered, 0.50) * 1000, 2),
+        "p95_ms": round(_percentile(ordered, 0.95) * 1000, 2),
+        "p99_ms": round(_percentile(ordered, 0.99) * 1000, 2),
+        "cpu_ms_per_message": round(cpu / messages * 1000, 3),
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_for_port(port, process, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("fake_twilio.py exited during startup")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"fake_twilio.py did not start listening on port {port}")
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, timeout=5, cwd=os.path.dirname(os.path.abspath(__file__))
+                              ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def _bench_env(api_url, workdir, concurrency, rate):
+    env = dict(os.environ)
+    env.update({
+        "TWILIO_API_BASE_URL": api_url,
+        "ACCOUNT_SID": BENCH_ACCOUNT_SID,
+        "AUTH_TOKEN": BENCH_AUTH_TOKEN,
+        "OUTBOX_PATH": os.path.join(workdir, f"outbox-{time.monotonic_ns()}.db"),
+        "SUPPRESSION_PATH": "",
+        "STATUS_CALLBACK_URL": "",
+        "METRICS_PORT": "0",
+        "PROFILE": "0",
+        "BULK_MAX_WORKERS": str(concurrency),
+        "TWILIO_POOL_SIZE": str(concurrency),
+        "ASYNC_MAX_IN_FLIGHT": str(concurrency),
+        # Fail fast instead of retrying when errors are injected
+        "SEND_MAX_ATTEMPTS": env.get("SEND_MAX_ATTEMPTS", "1"),
+    })
+    # 0 lifts the per-sender limit so the send path, not pacing, is measured
+    per_sender = str(rate) if rate else "1000000"
+    env["SEND_RATE_PER_SENDER"] = env["SEND_MAX_RATE_PER_SENDER"] = per_sender
+    return env
+
+
+def _time_to_output(command, marker, env, cwd):
+    started = time.perf_counter()
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.DEVNULL, env=env, cwd=cwd)
+    try:
+        output = b""
+        while marker not in output:
+            chunk = process.stdout.read1(4096)
+            if not chunk:
+                raise RuntimeError(f"{' '.join(command)} exited before it was ready")
+            output += chunk
+        return time.perf_counter() - started
+    finally:
+        process.kill()
+        process.wait()
+
+
+def _summary_ms(seconds):
+    ordered = sorted(seconds)
+    return {"median_ms": round(_percentile(ordered, 0.5) * 1000, 1),
+            "min_ms": round(ordered[0] * 1000, 1),
+            "p95_ms": round(_percentile(ordered, 0.95) * 1000, 1)}
+
+
+def run_startup(target, runs, env):
+    """Time a fresh start of target until it is ready, against a bare interpreter"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    script, marker = STARTUP_TARGETS[target]
+    command = [sys.executable, os.path.join(here, script)]
+    interpreter = [sys.executable, "-c", "pass"]
+    # One untimed start of each warms the OS file cache
+    _time_to_output(command, marker, env, here)
+    subprocess.run(interpreter, env=env)
+    ready, bare = [], []
+    for _ in range(runs):
+        ready.append(_time_to_output(command, marker, env, here))
+        started = time.perf_counter()
+        subprocess.run(interpreter, env=env)
+        bare.append(time.perf_counter() - started)
+    result = {"target": target, "runs": runs, "ready": _summary_ms(ready),
+              "interpreter": _summary_ms(bare)}
+    if target == "gui":
+        result["deferred_sections_ms"] = _deferred_sections(env)
+    return result
+
+
+def time_deferred_sections():
+    """Open the GUI and time the first showing of each section it builds lazily"""
+    from gui_main import WhatsAppGUI
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        app = WhatsAppGUI()
+        app.root.update()
+    timings = {}
+    for section, choice in DEFERRED_SECTIONS:
+        started = time.perf_counter()
+        app.schedule_var.set(choice)
+        app.on_schedule_change()
+        app.root.update_idletasks()
+        timings[section] = time.perf_counter() - started
+    app.root.destroy()
+    return timings
+
+
+def _deferred_sections(env):
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = {section: [] for section, _ in DEFERRED_SECTIONS}
+    for _ in range(DEFERRED_SECTION_RUNS):
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "--run-sections"],
+                               env=env, cwd=here, capture_output=True, text=True)
+        lines = child.stdout.strip().splitlines()
+        if child.returncode or not lines:
+            raise RuntimeError("could not open the GUI to time its deferred sections")
+        for section, seconds in json.loads(lines[-1]).items():
+            samples[section].append(seconds)
+    return {section: _summary_ms(seconds)["median_ms"] for section, seconds in samples.items()}
+
+
+def _print_startup(results):
+    print(f"{'target':<8}{'runs':>6}{'median ms':>11}{'min ms':>9}{'p95 ms':>9}"
+          f"{'bare python ms':>16}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['target']:<8}  failed: {r['error']}")
+            continue
+        print(f"{r['target']:<8}{r['runs']:>6}{r['ready']['median_ms']:>11}"
+              f"{r['ready']['min_ms']:>9}{r['ready']['p95_ms']:>9}"
+              f"{r['interpreter']['median_ms']:>16}")
+        for section, ms in r.get("deferred_sections_ms", {}).items():
+            print(f"  {section} built on first use in {ms} ms (kept off the first frame)")
+
+
+def _print_table(results):
+    print(f"{'scenario':<8}{'conc':>6}{'msgs':>7}{'fail':>6}{'msg/s':>9}{'p50 ms':>9}"
+          f"{'p95 ms':>9}{'p99 ms':>9}{'cpu ms/msg':>12}{'rss MB':>9}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['scenario']:<8}{r['concurrency']:>6}  failed: {r['error']}")
+            continue
+        print(f"{r['scenario']:<8}{r['concurrency']:>6}{r['messages']:>7}{r['failures']:>6}"
+              f"{r['messages_per_second']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}"
+              f"{r['cpu_ms_per_message']:>12}{r['peak_rss_mb'] if r['peak_rss_mb'] is not None else '-':>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the send paths against a local fake Twilio API")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="comma-separated scenarios to run (default %(default)s)")
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY,
+                        help="comma-separated concurrency levels (default %(default)s)")
+    parser.add_argument("--messages", type=int, default=DEFAULT_MESSAGES,
+                        help="messages sent per run (default %(default)s)")
+    parser.add_argument("--latency", default=DEFAULT_LATENCY,
+                        help="fake API create latency, as for fake_twilio.py (default %(default)s)")
+    parser.add_argument("--errors", default="",
+                        help="fake API error rates, as for fake_twilio.py, e.g. 429:0.01")
+    parser.add_argument("--rate", type=float, default=0,
+                        help="per-sender rate limit in messages/second (default 0 = unlimited)")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT,
+                        help="JSON results file (default %(default)s)")
+    parser.add_argument("--startup", action="store_true",
+                        help="time startup to the first prompt instead of sending")
+    parser.add_argument("--runs", type=int, default=DEFAULT_STARTUP_RUNS,
+                        help="starts timed per target with --startup (default %(default)s)")
+    parser.add_argument("--run-sections", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--run-one", nargs=3, metavar=("SCENARIO", "MESSAGES", "CONCURRENCY"),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_sections:
+        # Child process: time the GUI's deferred sections and report them on stdout
+        print(json.dumps(time_deferred_sections()))
+        return
+
+    if args.run_one:
+        # Child process: run a single measurement and report it on stdout
+        scenario, messages, concurrency = args.run_one
+        print(json.dumps(run_scenario(scenario, int(messages), int(concurrency))))
+        return
+
+    if args.startup:
+        with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+            # Nothing queued, so startup is measured without resuming old sends
+            env = _bench_env("http://127.0.0.1:9", workdir, 1, 0)
+            results = []
+            for target in STARTUP_TARGETS:
+                print(f"Starting {target} {args.runs} times...", flush=True)
+                try:
+                    results.append(run_startup(target, args.runs, env))
+                except RuntimeError as e:
+                    results.append({"target": target, "error": str(e)})
+        _print_startup(results)
+        _write_report(args.output, {"startup": results})
+        return
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    port = _free_port()
+    fake = subprocess.Popen([sys.executable, os.path.join(here, "fake_twilio.py"),
+                             "--port", str(port), "--latency", args.latency,
+                             "--errors", args.errors, "--auth-token", ""],
+                            stdout=subprocess.DEVNULL, cwd=here)
+    results = []
+    try:
+        _wait_for_port(port, fake)
+        api_url = f"http://127.0.0.1:{port}"
+        with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+            for scenario in scenarios:
+                for concurrency in levels:
+                    print(f"Running {scenario} at concurrency {concurrency}...", flush=True)
+                    child = subprocess.run(
+                        [sys.executable, os.path.abspath(__file__), "--run-one", scenario,
+                         str(args.messages), str(concurrency)],
+                        env=_bench_env(api_url, workdir, concurrency, args.rate), cwd=workdir,
+                        capture_output=True, text=True)
+                    lines = child.stdout.strip().splitlines()
+                    try:
+                        results.append(json.loads(lines[-1]))
+                    except (IndexError, ValueError):
+                        error = (child.stderr.strip().splitlines() or ["no output"])[-1]
+                        results.append({"scenario": scenario, "concurrency": concurrency,
+                                        "error": error})
+    finally:
+        fake.terminate()
+        fake.wait()
+
+    print()
+    _print_table(results)
+    _write_report(args.output, {
+        "fake_api": {"latency": args.latency, "errors": args.errors},
+        "rate_per_sender": args.rate or None,
+        "results": results,
+    })
+
+
+def _write_report(path, results):
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": _git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+    report.update(results)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nResults written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Concurrent bulk-send engine for WhatsApp campaigns
+
+All messages go through one shared Twilio Client and a bounded worker
+pool, so the time spent waiting on network round trips overlaps instead
+of adding up.  Results are yielded as each send finishes.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import time
+
+from messaging import create_message, find_sent_message
+from metrics import track_send
+from profiling import traced
+from retry import call_with_retry, may_have_been_sent
+from sender_pool import SenderPool
+from transport import DEFAULT_MAX_WORKERS
+
+# Outcome of a single send: result is the message SID on success,
+# otherwise the error text
+SendResult = namedtuple("SendResult", ["index", "recipient", "success", "result"])
+
+
+class BulkSender:
+    """Send many messages through a bounded worker pool sharing one Client
+
+    Messages without an explicit sender number are spread over the sender
+    pool (WHATSAPP_SENDERS unless a pool or a fixed from_ is given).
+    Recipients on the suppression list fail with SuppressedError without
+    a request being made.
+    """
+
+    def __init__(self, client, from_=None, max_workers=DEFAULT_MAX_WORKERS,
+                 rate_limiter=None, retry_policy=None, sender_pool=None, suppression=None,
+                 status_callback=None):
+        self.client = client
+        self.suppression = suppression
+        # Twilio POSTs delivery status changes here when set
+        self._create_options = {"status_callback": status_callback} if status_callback else {}
+        self.max_workers = max(1, int(max_workers))
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.sender_pool = sender_pool or SenderPool([from_] if from_ else None,
+                                                     rate_limiter=rate_limiter)
+
+    def _create(self, recipient, body, from_):
+        if self.rate_limiter is None:
+            return create_message(self.client, recipient, body, from_=from_, **self._create_options)
+        return self.rate_limiter.call(from_, create_message, self.client, recipient, body,
+                                      from_=from_, **self._create_options)
+
+    @traced("bulk_sender.send_one")
+    def send_one(self, recipient, body, from_=None, sent_since=None):
+        """Send a single message and return its SID
+
+        sent_since is when an earlier attempt that may have reached Twilio
+        started (for example by a worker that crashed mid-send).  If Twilio
+        already has a matching message from then on, its SID is returned
+        instead of sending again; retries after a timeout or 5xx are
+        checked the same way.
+        """
+        with track_send():
+            if self.suppression is not None:
+                self.suppression.check(recipient)
+            from_ = from_ or self.sender_pool.select(recipient)
+            unsure_since = [sent_since]
+
+            def create_once():
+                if unsure_since[0] is not None:
+                    sid = find_sent_message(self.client, recipient, body, unsure_since[0])
+                    if sid is not None:
+                        return sid
+                started = time.time()
+                try:
+                    return self._create(recipient, body, from_).sid
+                except Exception as e:
+                    if unsure_since[0] is None and may_have_been_sent(e):
+                        unsure_since[0] = started
+                    raise
+
+            with self.sender_pool.sending(from_):
+                if self.retry_policy is None:
+                    return create_once()
+                return call_with_retry(self.retry_policy, create_once)
+
+    def _run(self, index, recipient, body, from_, sent_since=None):
+        try:
+            return SendResult(index, recipient, True,
+                              self.send_one(recipient, body, from_, sent_since))
+        except Exception as e:
+            return SendResult(index, recipient, False, str(e))
+
+    def _send(self, jobs, max_workers):
+        max_workers = self.max_workers if max_workers is None else max(1, int(max_workers))
+        window = max_workers * 2
+        pending = set()
+
+        with ThreadPoolExecutor(max_workers=max_workers,
+                                thread_name_prefix="bulk-send") as executor:
+            for job in jobs:
+                pending.add(executor.submit(self._run, *job))
+                if len(pending) >= window:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+    def send(self, messages, max_workers=None):
+        """Send (recipient, body) pairs, yielding a SendResult as each one finishes
+
+        At most ``2 * max_workers`` sends are queued at any time, so the input
+        iterable can be a generator over a very large campaign.
+        """
+        jobs = ((index, recipient, body, None) for index, (recipient, body) in enumerate(messages))
+        return self._send(jobs, max_workers)
+
+    def send_outbox(self, outbox, batch_size=500, max_workers=None):
+        """Drain due messages from the outbox, yielding a SendResult per message
+
+        Work is claimed from the outbox in batches as the pool frees up, and
+        results are written back in batches.  SendResult.index is the outbox
+        message id.
+        """
+        return self.send_claimed(outbox, outbox.claim_batches(batch_size), max_workers)
+
+    def send_claimed(self, outbox, messages, max_workers=None):
+        """Send already-claimed OutboxMessages, recording each result in the outbox
+
+        messages can be a generator that claims lazily; it is consumed only
+        as fast as the pool frees up.
+        """
+        jobs = ((message.id, message.recipient, message.body, message.from_number,
+                 resend_check_since(message))
+                for message in messages)
+        try:
+            for result in self._send(jobs, max_workers):
+                if result.success:
+                    outbox.mark_sent(result.index, result.result)
+                else:
+                    outbox.mark_failed(result.index, result.result)
+                yield result
+        finally:
+            outbox.flush()
+
+
+def resend_check_since(message):
+    """For a claimed OutboxMessage, return the time from which Twilio should be
+    checked for an earlier copy, or None for a first attempt
+
+    A message claimed before (its lease ran out, or the process stopped)
+    may have been sent without the result being recorded.
+    """
+    return message.send_at if message.attempts else None
+
+
+def send_bulk(client, messages, from_=None, max_workers=DEFAULT_MAX_WORKERS,
+              rate_limiter=None, retry_policy=None, sender_pool=None, suppression=None,
+              status_callback=None):
+    """Convenience wrapper around BulkSender.send"""
+    sender = BulkSender(client, from_=from_, max_workers=max_workers,
+                        rate_limiter=rate_limiter, retry_policy=retry_policy,
+                        sender_pool=sender_pool, suppression=suppression,
+                        status_callback=status_callback)
+    return sender.send(messages)
@@ -0,0 +1,165 @@
+"""Cron expressions and simple recurrence phrases for recurring messages
+
+Supports standard five-field cron syntax (minute hour day month weekday)
+with lists, ranges, steps and month/day names, the usual @daily-style
+aliases, and a few plain phrases:
+
+    every day at 09:00
+    every weekday at 09:00
+    every monday at 18:30
+    every hour
+
+The next fire time is found by jumping a field at a time (month, then
+day, hour and minute), so it never scans minute by minute.
+"""
+
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from functools import lru_cache
+import calendar
+import re
+
+
+class CronError(ValueError):
+    """Raised for an expression that cannot be parsed"""
+    pass
+
+
+_ALIASES = {
+    "@yearly": "0 0 1 1 *",
+    "@annually": "0 0 1 1 *",
+    "@monthly": "0 0 1 * *",
+    "@weekly": "0 0 * * 0",
+    "@daily": "0 0 * * *",
+    "@midnight": "0 0 * * *",
+    "@hourly": "0 * * * *",
+}
+
+_MONTH_NAMES = {name.lower(): i for i, name in enumerate(calendar.month_abbr) if name}
+_DAY_NAMES = {name.lower(): (i + 1) % 7 for i, name in enumerate(calendar.day_abbr)}
+
+# Phrase day words mapped to cron weekday fields
+_PHRASE_DAYS = {"day": "*", "weekday": "1-5", "weekend": "0,6"}
+_PHRASE_DAYS.update({name.lower(): str((i + 1) % 7) for i, name in enumerate(calendar.day_name)})
+
+_PHRASE = re.compile(r"^every\s+(\w+?)s?\s+at\s+(\d{1,2}):(\d{2})$")
+
+# (low, high, names) for minute, hour, day of month, month, day of week
+_FIELDS = (
+    (0, 59, {}),
+    (0, 23, {}),
+    (1, 31, {}),
+    (1, 12, _MONTH_NAMES),
+    (0, 7, _DAY_NAMES),
+)
+
+
+def _parse_value(value, names):
+    value = value.lower()
+    if value in names:
+        return names[value]
+    if not value.isdigit():
+        raise CronError(f"Invalid cron value: {value}")
+    return int(value)
+
+
+def _parse_field(field, low, high, names):
+    values = set()
+    for part in field.split(","):
+        step = 1
+        if "/" in part:
+            part, step_text = part.split("/", 1)
+            if not step_text.isdigit() or int(step_text) == 0:
+                raise CronError(f"Invalid cron step: {step_text}")
+            step = int(step_text)
+        if part == "*":
+            start, end = low, high
+        elif "-" in part:
+            start_text, end_text = part.split("-", 1)
+            start, end = _parse_value(start_text, names), _parse_value(end_text, names)
+        else:
+            start = _parse_value(part, names)
+            end = high if step > 1 else start
+        if not low <= start <= end <= high:
+            raise CronError(f"Cron value out of range: {part}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def phrase_to_cron(text):
+    """Translate a phrase like 'every weekday at 09:00' to a cron expression, or None"""
+    text = " ".join(text.lower().split())
+    if text == "every hour":
+        return "0 * * * *"
+    match = _PHRASE.match(text)
+    if not match:
+        return None
+    day, hour, minute = match.group(1), int(match.group(2)), int(match.group(3))
+    if day not in _PHRASE_DAYS or hour > 23 or minute > 59:
+        return None
+    return f"{minute} {hour} * * {_PHRASE_DAYS[day]}"
+
+
+class CronExpression:
+    """A parsed cron schedule that can compute its next fire time"""
+
+    def __init__(self, expression):
+        self.expression = expression.strip()
+        text = phrase_to_cron(self.expression) or _ALIASES.get(self.expression.lower(),
+                                                               self.expression)
+        fields = text.split()
+        if len(fields) != 5:
+            raise CronError(f"Expected 5 cron fields or a phrase like "
+                            f"'every weekday at 09:00', got: {expression}")
+        parsed = [_parse_field(field, low, high, names)
+                  for field, (low, high, names) in zip(fields, _FIELDS)]
+        self.minutes, self.hours, self.days, self.months, weekdays = parsed
+        self._minute_list = sorted(self.minutes)
+        self._hour_list = sorted(self.hours)
+        # Cron allows both 0 and 7 for Sunday
+        self.weekdays = {day % 7 for day in weekdays}
+        self.days_restricted = fields[2] != "*"
+        self.weekdays_restricted = fields[4] != "*"
+
+    def __repr__(self):
+        return f"CronExpression({self.expression!r})"
+
+    def _day_matches(self, moment):
+        in_days = moment.day in self.days
+        in_weekdays = (moment.weekday() + 1) % 7 in self.weekdays
+        # Standard cron: if both day fields are restricted, either may match
+        if self.days_restricted and self.weekdays_restricted:
+            return in_days or in_weekdays
+        return in_days and in_weekdays
+
+    def next_after(self, moment):
+        """Return the first fire time strictly after the given naive datetime"""
+        moment = moment.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        limit = moment.year + 5
+        while moment.year <= limit:
+            if moment.month not in self.months:
+                year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+                moment = datetime(year, month, 1)
+                continue
+            if not self._day_matches(moment):
+                moment = datetime(moment.year, moment.month, moment.day) + timedelta(days=1)
+                continue
+            # Jump straight to the next allowed hour and minute of this day
+            index = bisect_left(self._hour_list, moment.hour)
+            if index == len(self._hour_list):
+                moment = datetime(moment.year, moment.month, moment.day) + timedelta(days=1)
+                continue
+            if self._hour_list[index] != moment.hour:
+                moment = moment.replace(hour=self._hour_list[index], minute=0)
+            index = bisect_left(self._minute_list, moment.minute)
+            if index == len(self._minute_list):
+                moment = moment.replace(minute=0) + timedelta(hours=1)
+                continue
+            return moment.replace(minute=self._minute_list[index])
+        raise CronError(f"Schedule never fires: {self.expression}")
+
+
+@lru_cache(maxsize=1024)
+def parse(expression):
+    """Parse an expression once; repeated schedules share the parsed result"""
+    return CronExpression(expression)
@@ -0,0 +1,446 @@
+"""Local stand-in for Twilio's Messages API, for load and latency testing
+
+Serves the endpoints the senders use, under the real paths:
+
+    POST /2010-04-01/Accounts/{AccountSid}/Messages.json         create
+    GET  /2010-04-01/Accounts/{AccountSid}/Messages.json         list (To, From, DateSent>, paging)
+    GET  /2010-04-01/Accounts/{AccountSid}/Messages/{Sid}.json   fetch
+
+Each create waits for a delay drawn from a latency distribution, fails
+with the configured error rates, and, when the request has a
+StatusCallback, posts signed sent / delivered (or undelivered) callbacks
+afterwards, like Twilio does.  Start it and point the clients at it with
+one setting:
+
+    python fake_twilio.py --latency lognormal:0.2,0.5 --errors 429:0.02,503:0.01,21611:0.01
+    TWILIO_API_BASE_URL=http://127.0.0.1:8089       # in .env
+
+Latency specs: a number of seconds, ``constant:S``, ``uniform:LOW,HIGH``,
+``normal:MEAN,STDDEV``, ``lognormal:MEDIAN,SIGMA`` or ``exponential:MEAN``.
+Error specs: comma-separated ``CODE:RATE`` pairs, where CODE is an HTTP
+status (429, 500, 503, ...) or a Twilio error code answered with HTTP 400
+(21211, 21611, ...).
+"""
+
+from base64 import b64decode
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+import argparse
+import calendar
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.request
+import uuid
+
+import dotenv
+
+# Load environment variables from .env file (before the settings below are read)
+dotenv.load_dotenv()
+
+from scheduler import Scheduler
+
+# Address the fake API listens on
+DEFAULT_HOST = os.getenv("FAKE_TWILIO_HOST", "127.0.0.1")
+DEFAULT_PORT = int(os.getenv("FAKE_TWILIO_PORT", "8089"))
+
+# Delay before each create is answered (see the module docstring for the format)
+DEFAULT_LATENCY = os.getenv("FAKE_TWILIO_LATENCY", "lognormal:0.15,0.35")
+
+# Injected create failures, e.g. "429:0.02,503:0.01,21611:0.01"
+DEFAULT_ERRORS = os.getenv("FAKE_TWILIO_ERRORS", "")
+
+# Seconds between a create and each status callback, and the share of
+# messages that end up undelivered instead of delivered
+DEFAULT_CALLBACK_DELAY = float(os.getenv("FAKE_TWILIO_CALLBACK_DELAY", "1"))
+DEFAULT_UNDELIVERED_RATE = float(os.getenv("FAKE_TWILIO_UNDELIVERED_RATE", "0"))
+
+API_VERSION = "2010-04-01"
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+# Twilio's error code and message for each injectable HTTP status
+_HTTP_ERRORS = {
+    429: (20429, "Too Many Requests"),
+    500: (20500, "Internal Server Error"),
+    502: (20500, "Bad Gateway"),
+    503: (20503, "Service Unavailable"),
+    504: (20500, "Gateway Timeout"),
+}
+
+_TWILIO_ERRORS = {
+    21211: "Invalid 'To' Phone Number",
+    21408: "Permission to send an SMS has not been enabled for the region",
+    21610: "Attempt to send to unsubscribed recipient",
+    21611: "This 'From' number has exceeded the maximum number of queued messages",
+    21614: "'To' number is not a valid mobile number",
+    63007: "Twilio could not find a Channel with the specified From address",
+}
+
+_MESSAGES_PATH = re.compile(
+    rf"^/{API_VERSION}/Accounts/(?P<account>[^/]+)/Messages(?:/(?P<sid>[^/]+))?\.json$")
+
+
+def parse_latency(spec):
+    """Return a function drawing one delay in seconds from a latency spec"""
+    spec = str(spec).strip() or "0"
+    kind, _, params = spec.partition(":")
+    try:
+        if not params:
+            value = float(kind)
+            return lambda: value
+        args = [float(p) for p in params.split(",")]
+        if kind == "constant":
+            return lambda: args[0]
+        if kind == "uniform":
+            return lambda: random.uniform(args[0], args[1])
+        if kind == "normal":
+            return lambda: max(0.0, random.gauss(args[0], args[1]))
+        if kind == "lognormal":
+            mu = math.log(args[0])
+            return lambda: random.lognormvariate(mu, args[1])
+        if kind == "exponential":
+            return lambda: random.expovariate(1.0 / args[0])
+    except (ValueError, IndexError, ZeroDivisionError):
+        pass
+    raise ValueError(f"Invalid latency spec: {spec!r}")
+
+
+def parse_errors(spec):
+    """Return [(code, rate)] from "CODE:RATE,..." """
+    errors = []
+    for item in filter(None, (part.strip() for part in str(spec).split(","))):
+        code, _, rate = item.partition(":")
+        try:
+            errors.append((int(code), float(rate)))
+        except ValueError:
+            raise ValueError(f"Invalid error spec: {item!r}") from None
+    if sum(rate for _, rate in errors) > 1:
+        raise ValueError("Error rates add up to more than 1")
+    return errors
+
+
+def error_response(code):
+    """Return (HTTP status, JSON payload) of the Twilio error for an injected code"""
+    if code in _HTTP_ERRORS:
+        status = code
+        code, message = _HTTP_ERRORS[code]
+    elif code < 1000:
+        status, message = code, "Error"
+    else:
+        status, message = 400, _TWILIO_ERRORS.get(code, "Error")
+    return status, {"code": code, "message": message, "status": status,
+                    "more_info": f"https://www.twilio.com/docs/errors/{code}"}
+
+
+def _rfc2822(timestamp):
+    return formatdate(timestamp, usegmt=True) if timestamp is not None else None
+
+
+def _parse_date_filter(value):
+    for layout in ("%Y-%m-%dT%H:%M:%SZ", "%Y-%m-%d"):
+        try:
+            return calendar.timegm(time.strptime(value, layout))
+        except ValueError:
+            continue
+    return None
+
+
+class _FakeMessage:
+    __slots__ = ("sid", "account_sid", "to", "from_", "body", "status", "error_code",
+                 "date_created", "date_sent", "date_updated", "status_callback")
+
+    def __init__(self, account_sid, to, from_, body, status_callback):
+        now = time.time()
+        self.sid = "SM" + uuid.uuid4().hex
+        self.account_sid = account_sid
+        self.to = to
+        self.from_ = from_
+        self.body = body
+        self.status = "queued"
+        self.error_code = None
+        self.date_created = now
+        self.date_sent = None
+        self.date_updated = now
+        self.status_callback = status_callback
+
+    def resource(self):
+        return {
+            "sid": self.sid, "account_sid": self.account_sid, "to": self.to, "from": self.from_,
+            "body": self.body, "status": self.status, "error_code": self.error_code,
+            "error_message": None, "direction": "outbound-api", "num_segments": "1",
+            "num_media": "0", "price": None, "price_unit": "USD", "api_version": API_VERSION,
+            "messaging_service_sid": None,
+            "date_created": _rfc2822(self.date_created), "date_sent": _rfc2822(self.date_sent),
+            "date_updated": _rfc2822(self.date_updated),
+            "uri": f"/{API_VERSION}/Accounts/{self.account_sid}/Messages/{self.sid}.json",
+            "subresource_uris": {},
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # Keep-alive, so pooled clients reuse their connections as with the real API
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out as separate writes; with Nagle on, the body would
+    # wait for the client's delayed ACK and add ~40 ms to every response
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def _dispatch(self, method):
+        fake = self.server.fake
+        parts = urlsplit(self.path)
+        match = _MESSAGES_PATH.match(parts.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        form = dict(parse_qsl(self.rfile.read(length).decode("utf-8"))) if length else {}
+        if match is None:
+            self._reply(404, {"code": 20404, "message": "The requested resource was not found",
+                              "status": 404})
+            return
+        account, sid = match.group("account"), match.group("sid")
+        if not fake.is_authorized(account, self.headers.get("Authorization", "")):
+            self._reply(401, {"code": 20003, "message": "Authenticate", "status": 401})
+            return
+        if method == "POST" and sid is None:
+            self._reply(*fake.create(account, form))
+        elif method == "GET" and sid is None:
+            self._reply(*fake.list(account, dict(parse_qsl(parts.query))))
+        elif method == "GET":
+            self._reply(*fake.fetch(sid))
+        else:
+            self._reply(405, {"code": 20004, "message": "Method not allowed", "status": 405})
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # a line per request would dominate a load test
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Room for a burst of new connections from a large client pool
+    request_queue_size = 1024
+
+
+class FakeTwilio:
+    """In-process fake of the Messages API with injectable latency and errors
+
+    auth_token, when given, is checked against the Basic auth password and
+    used to sign status callbacks.
+    """
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, latency=DEFAULT_LATENCY,
+                 errors=DEFAULT_ERRORS, callback_delay=DEFAULT_CALLBACK_DELAY,
+                 undelivered_rate=DEFAULT_UNDELIVERED_RATE, auth_token=None):
+        self.host = host
+        self.port = port
+        self.latency = parse_latency(latency)
+        self.errors = parse_errors(errors)
+        self.callback_delay = callback_delay
+        self.undelivered_rate = undelivered_rate
+        self.auth_token = auth_token or None
+        self.created = 0
+        self.failed = 0
+        self.callbacks = 0
+        self._lock = threading.Lock()
+        self._messages = {}
+        self._order = []
+        self._validator = None
+        self._server = None
+        self._thread = None
+        self._scheduler = None
+
+    @property
+    def url(self):
+        """Base URL to set as TWILIO_API_BASE_URL"""
+        return f"http://{self.host}:{self.port}"
+
+    def is_authorized(self, account, header):
+        if not header.startswith("Basic "):
+            return False
+        try:
+            username, _, password = b64decode(header[6:]).decode("utf-8").partition(":")
+        except ValueError:
+            return False
+        # API keys (SK...) authenticate for the account in the path
+        if username != account and not username.startswith("SK"):
+            return False
+        return self.auth_token is None or password == self.auth_token
+
+    def _injected_error(self):
+        draw = random.random()
+        for code, rate in self.errors:
+            if draw < rate:
+                return code
+            draw -= rate
+        return None
+
+    def create(self, account, form):
+        """Handle one create: wait, then fail or store the message"""
+        time.sleep(self.latency())
+        code = self._injected_error()
+        if code is not None:
+            with self._lock:
+                self.failed += 1
+            return error_response(code)
+        if not (form.get("To") and form.get("From") and form.get("Body")):
+            with self._lock:
+                self.failed += 1
+            return 400, {"code": 21604, "message": "A 'To', 'From' and 'Body' are required",
+                         "status": 400}
+        message = _FakeMessage(account, form["To"], form["From"], form["Body"],
+                               form.get("StatusCallback"))
+        with self._lock:
+            self.created += 1
+            self._messages[message.sid] = message
+            self._order.append(message)
+        if message.status_callback and self._scheduler is not None:
+            self._scheduler.schedule(time.time() + self.callback_delay, self._advance,
+                                     message, "sent")
+        return 201, message.resource()
+
+    def fetch(self, sid):
+        with self._lock:
+            message = self._messages.get(sid)
+            if message is not None:
+                return 200, message.resource()
+        return 404, {"code": 20404, "message": f"Message {sid} was not found", "status": 404}
+
+    def list(self, account, query):
+        """Page through stored messages, newest first"""
+        page_size = min(MAX_PAGE_SIZE, int(query.get("PageSize") or DEFAULT_PAGE_SIZE))
+        page = int(query.get("Page") or 0)
+        to, from_ = query.get("To"), query.get("From")
+        sent_after = _parse_date_filter(query.get("DateSent>", "")) if query.get("DateSent>") else None
+        with self._lock:
+            messages = reversed(self._order)
+            selected = [m for m in messages
+                        if (to is None or m.to == to) and (from_ is None or m.from_ == from_)
+                        and (sent_after is None or (m.date_sent or m.date_created) >= sent_after)]
+            window = selected[page * page_size:(page + 1) * page_size]
+            resources = [m.resource() for m in window]
+        base = f"/{API_VERSION}/Accounts/{account}/Messages.json"
+        filters = {k: v for k, v in query.items() if k not in ("Page", "PageSize", "PageToken")}
+        next_page_uri = None
+        if (page + 1) * page_size < len(selected):
+            next_page_uri = base + "?" + urlencode(dict(filters, PageSize=page_size, Page=page + 1))
+        return 200, {
+            "messages": resources, "page": page, "page_size": page_size,
+            "first_page_uri": base + "?" + urlencode(dict(filters, PageSize=page_size, Page=0)),
+            "next_page_uri": next_page_uri, "previous_page_uri": None,
+            "uri": base + "?" + urlencode(dict(filters, PageSize=page_size, Page=page)),
+            "start": page * page_size, "end": page * page_size + len(resources),
+        }
+
+    def _advance(self, message, status):
+        now = time.time()
+        with self._lock:
+            message.status = status
+            message.date_updated = now
+            if status == "sent":
+                message.date_sent = now
+            elif status == "undelivered":
+                message.error_code = 30003  # Unreachable destination handset
+        self._post_callback(message)
+        if status == "sent":
+            final = "undelivered" if random.random() < self.undelivered_rate else "delivered"
+            self._scheduler.schedule(time.time() + self.callback_delay, self._advance,
+                                     message, final)
+
+    def _post_callback(self, message):
+        params = {"MessageSid": message.sid, "SmsSid": message.sid,
+                  "MessageStatus": message.status, "SmsStatus": message.status,
+                  "AccountSid": message.account_sid, "From": message.from_, "To": message.to,
+                  "ApiVersion": API_VERSION}
+        if message.error_code:
+            params["ErrorCode"] = str(message.error_code)
+        headers = {"Content-Type": "application/x-www-form-urlencoded"}
+        if self._validator is not None:
+            headers["X-Twilio-Signature"] = self._validator.compute_signature(
+                message.status_callback, params)
+        request = urllib.request.Request(message.status_callback, data=urlencode(params).encode(),
+                                         headers=headers, method="POST")
+        try:
+            urllib.request.urlopen(request, timeout=10).close()
+            with self._lock:
+                self.callbacks += 1
+        except OSError as e:
+            print(f"Status callback to {message.status_callback} failed: {e}")
+
+    def stats(self):
+        """Return counts of created and failed creates and delivered callbacks"""
+        with self._lock:
+            return {"created": self.created, "failed": self.failed, "callbacks": self.callbacks}
+
+    def start(self):
+        """Start serving in background threads; raises OSError if the port is taken"""
+        if self.auth_token:
+            from twilio.request_validator import RequestValidator
+            self._validator = RequestValidator(self.auth_token)
+        self._scheduler = Scheduler()
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.fake = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-twilio",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving; pending status callbacks are dropped"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+        if self._scheduler is not None:
+            self._scheduler.stop(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local fake of Twilio's Messages API")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--latency", default=DEFAULT_LATENCY,
+                        help="create latency, e.g. 0.2, uniform:0.1,0.3 or lognormal:0.15,0.35 "
+                             "(default %(default)s)")
+    parser.add_argument("--errors", default=DEFAULT_ERRORS,
+                        help="injected failures as CODE:RATE pairs, e.g. 429:0.02,503:0.01,21611:0.01")
+    parser.add_argument("--callback-delay", type=float, default=DEFAULT_CALLBACK_DELAY,
+                        help="seconds between a create and each status callback (default %(default)s)")
+    parser.add_argument("--undelivered-rate", type=float, default=DEFAULT_UNDELIVERED_RATE,
+                        help="share of messages reported undelivered (default %(default)s)")
+    parser.add_argument("--auth-token", default=os.getenv("AUTH_TOKEN"),
+                        help="check this auth token and sign callbacks with it (default AUTH_TOKEN)")
+    args = parser.parse_args()
+
+    fake = FakeTwilio(args.host, args.port, args.latency, args.errors, args.callback_delay,
+                      args.undelivered_rate, args.auth_token).start()
+    print(f"Fake Twilio API listening on {fake.url}; set TWILIO_API_BASE_URL={fake.url} "
+          "and press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake.stop()
+    print(f"Stats: {fake.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,26 @@
+import time
+
+# Cold-start reference point: time to first frame is measured from here
+LAUNCHED_AT = time.perf_counter()
+
 import customtkinter as ctk
-from twilio.rest import Client
 from datetime import datetime, timedelta
-import time
 import dotenv
 import os
 import threading
 from tkinter import messagebox
-import re
 import calendar
 
-# Load environment variables from .env file
+# Load environment variables from .env file (before the modules below read their settings)
 dotenv.load_dotenv()
 
+import profiling
+from phones import PhoneCleaner, normalize
+
+# Twilio, the send services and the scheduler are imported on the
+# "twilio-init" thread (initialize_twilio) once the window is on screen,
+# and by the methods that use them after that
+
 # Set appearance mode and color theme
 ctk.set_appearance_mode("Light")  # Light mode for white background
 ctk.set_default_color_theme("blue")  # Themes: "blue" (standard), "green", "dark-blue"
@@ -21,6 +30,15 @@ SEND_MESSAGE_TEXT = "Send Message"
 SCHEDULE_MESSAGE_TEXT = "Schedule Message"
 VALIDATION_ERROR_TITLE = "Validation Error"
 
+# How often the countdown display refreshes, however many messages are scheduled
+COUNTDOWN_TICK_MS = 1000
+
+# Connection indicator colors
+CONNECTING_COLOR = "gray"
+CONNECTED_COLOR = "#2e8b57"
+WARNING_COLOR = "#cc7a00"
+ERROR_COLOR = "#cc0000"
+
 # Blue and white theme colors
 LIGHT_BLUE_BG = "#f0f8ff"  # Alice blue background for sections
 BLUE_TEXT = "#0066cc"      # Blue text for headers
@@ -41,28 +59,151 @@ class WhatsAppGUI:
         self.root.resizable(True, True)
         self.root.configure(fg_color=WHITE_BG)  # Set white background
         
-        # Twilio client
+        # Twilio client and send services, built by initialize_twilio on a
+        # background thread; sending stays disabled until services_ready
         self.client = None
-        self.initialize_twilio()
+        self.account_sid = None
+        self.auth_token = None
+        self.services_ready = False
+        self.startup_error = None
+        
+        self.scheduled_jobs = {}
+        # Restored messages that fired before restore_scheduled_jobs listed them
+        self.fired_jobs = set()
+        self.countdown_after_id = None
+        self.last_countdown_logged = None
+        
+        # Shared asyncio loop for immediate sends (started on first use)
+        self.async_loop = None
+        self.async_sender = None
         
         # Variables
         self.is_sending = False
         
         self.setup_ui()
+        self.send_button.configure(state="disabled")
+        
+        # Runs once the first frame is drawn, then starts initialize_twilio
+        self.root.after_idle(self.on_first_frame)
+        
+    def on_first_frame(self):
+        """Report the cold-start time to first frame and start Twilio initialization"""
+        elapsed_ms = (time.perf_counter() - LAUNCHED_AT) * 1000
+        print(f"Window ready {elapsed_ms:.0f} ms after launch", flush=True)
+        self.update_status(f"Window ready in {elapsed_ms:.0f} ms; connecting to Twilio...")
+        threading.Thread(target=self.initialize_twilio, name="twilio-init", daemon=True).start()
         
     def initialize_twilio(self):
-        """Initialize Twilio client with credentials from .env file"""
+        """Import Twilio, build the client and send services, then check the credentials
+        
+        Runs on a background thread; results reach the window through root.after.
+        """
+        started = time.perf_counter()
         account_sid = os.getenv("ACCOUNT_SID")
         auth_token = os.getenv("AUTH_TOKEN")
-        
         if account_sid and auth_token:
+            self.account_sid = account_sid
+            self.auth_token = auth_token
+        
+        try:
+            self.initialize_services()
+        except Exception as e:
+            self.root.after(0, self.on_services_failed, e)
+            return
+        
+        error = None
+        if self.account_sid:
             try:
-                self.client = Client(account_sid, auth_token)
+                from transport import build_client
+                self.client = build_client(account_sid, auth_token)
             except Exception as e:
-                messagebox.showerror("Twilio Error", f"Failed to initialize Twilio client: {e}")
+                error = e
+        self.root.after(0, self.on_services_ready, error, time.perf_counter() - started)
+        
+        if self.client is not None:
+            state, detail = self.check_credentials()
+            self.root.after(0, self.set_connection_status, state, detail)
+    
+    def initialize_services(self):
+        """Build the outbox, scheduler and send helpers shared by every send"""
+        from metrics import start_metrics_server
+        from outbox import Outbox
+        from rate_limiter import AdaptiveRateLimiter
+        from recurring import RecurringSchedules
+        from retry import RetryPolicy
+        from scheduler import Scheduler
+        from sender_pool import SenderPool
+        from status_receiver import start_status_receiver
+        from suppression import SuppressionList
+        
+        # Paces every send per sender number and backs off when Twilio throttles
+        self.rate_limiter = AdaptiveRateLimiter()
+        
+        # Spreads recipients over the WHATSAPP_SENDERS numbers (the sandbox number by default)
+        self.sender_pool = SenderPool(rate_limiter=self.rate_limiter)
+        
+        # Numbers that opted out; checked before every send
+        self.suppression = SuppressionList()
+        
+        # Retries temporary failures with backoff; permanent ones fail fast
+        self.retry_policy = RetryPolicy()
+        
+        # Durable queue: every message is stored here before it is sent
+        self.outbox = Outbox()
+        
+        # Records delivered/read/failed callbacks when STATUS_CALLBACK_URL is set
+        self.status_receiver = start_status_receiver(self.outbox, self.auth_token)
+        
+        # One timer thread fires every scheduled message
+        self.scheduler = Scheduler()
+        
+        # Serves send metrics on /metrics when METRICS_PORT is set
+        self.metrics_server = start_metrics_server(self.outbox, self.scheduler)
+        self.recurring = RecurringSchedules(self.outbox, self.scheduler, self.fire_recurring_message)
+    
+    def check_credentials(self):
+        """Make one small authenticated request; return (state, detail) for the indicator"""
+        from twilio.base.exceptions import TwilioException, TwilioRestException
+        
+        try:
+            self.client.messages.list(limit=1)
+        except (TwilioRestException, TwilioException) as e:
+            # Listing raises a plain TwilioException carrying the HTTP response
+            status = getattr(e, "status", None) or getattr(e.args[-1], "status_code", None)
+            if status in (401, 403):
+                return "error", "Twilio rejected ACCOUNT_SID / AUTH_TOKEN"
+            return "warning", f"Twilio check failed ({status or e}); sends will still be tried"
+        except Exception as e:
+            return "warning", f"Could not reach Twilio ({e.__class__.__name__}); sends will be retried"
+        return "connected", "Connected to Twilio"
+    
+    def on_services_ready(self, error, seconds):
+        """Enable sending once initialize_twilio has built the services, on the Tk thread"""
+        self.services_ready = True
+        self.send_button.configure(state="normal")
+        if error is not None:
+            self.set_connection_status("error", f"Failed to initialize Twilio client: {error}")
+        elif self.client is None:
+            self.set_connection_status("warning", "Please set ACCOUNT_SID and AUTH_TOKEN in your .env file")
         else:
-            messagebox.showwarning("Missing Credentials", 
-                                 "Please set ACCOUNT_SID and AUTH_TOKEN in your .env file")
+            self.update_status(f"Twilio client ready in {seconds * 1000:.0f} ms; checking credentials...")
+        
+        # Deliver anything left over from a crashed or interrupted run
+        self.resume_outbox()
+    
+    def on_services_failed(self, error):
+        """Record that the send services could not be started, on the Tk thread"""
+        self.startup_error = f"Failed to start the send services: {error}"
+        self.set_connection_status("error", self.startup_error)
+        self.send_button.configure(state="normal")
+    
+    def set_connection_status(self, state, detail):
+        """Show the Twilio connection state in the indicator under the title"""
+        color = {"connecting": CONNECTING_COLOR, "connected": CONNECTED_COLOR,
+                 "warning": WARNING_COLOR, "error": ERROR_COLOR}[state]
+        self.connection_label.configure(text=f"● {detail}", text_color=color)
+        if state != "connecting":
+            self.update_status(detail)
     
     def setup_ui(self):
         """Setup the user interface without external dependencies"""        # Main title
@@ -72,7 +213,15 @@ class WhatsAppGUI:
             font=ctk.CTkFont(size=28, weight="bold"),
             text_color=BLUE_TEXT
         )
-        title_label.pack(pady=(20, 15))
+        title_label.pack(pady=(20, 5))
+        
+        # Twilio connection indicator, updated as background initialization finishes
+        self.connection_label = ctk.CTkLabel(
+            self.root,
+            text="● Connecting to Twilio...",
+            text_color=CONNECTING_COLOR
+        )
+        self.connection_label.pack(pady=(0, 10))
           # Create scrollable frame instead of regular frame
         self.scrollable_frame = ctk.CTkScrollableFrame(self.root)
         self.scrollable_frame.pack(fill="both", expand=True, padx=20, pady=(0, 20))
@@ -136,7 +285,7 @@ class WhatsAppGUI:
         msg_input_frame = ctk.CTkFrame(message_frame, fg_color="transparent")
         msg_input_frame.pack(fill="both", expand=True, padx=20, pady=(0, 20))
         
-        ctk.CTkLabel(msg_input_frame, text="Your Message:", anchor="w").pack(fill="x", pady=(0, 5))
+        ctk.CTkLabel(msg_input_frame, text="Your Message ({name} and {phone} are filled in):", anchor="w").pack(fill="x", pady=(0, 5))
         self.message_textbox = ctk.CTkTextbox(msg_input_frame, height=120)
         self.message_textbox.pack(fill="both", expand=True)
         
@@ -176,10 +325,42 @@ class WhatsAppGUI:
             command=self.on_schedule_change,
             font=ctk.CTkFont(size=14)
         )
-        self.schedule_radio.pack(side="left")
+        self.schedule_radio.pack(side="left", padx=(0, 30))
+        
+        self.recurring_radio = ctk.CTkRadioButton(
+            radio_frame, 
+            text="Recurring", 
+            variable=self.schedule_var, 
+            value="recurring",
+            command=self.on_schedule_change,
+            font=ctk.CTkFont(size=14)
+        )
+        self.recurring_radio.pack(side="left")
         
-        # DateTime picker frame (initially hidden)
-        self.datetime_frame = ctk.CTkFrame(scheduling_frame)
+        # The recurrence input and date/time picker are built by on_schedule_change
+        # the first time they are chosen; "Send Immediately" needs neither
+        self.scheduling_frame = scheduling_frame
+        self.recurring_frame = None
+        self.datetime_frame = None
+        
+        # Add padding
+        ctk.CTkLabel(scheduling_frame, text="").pack(pady=10)
+    
+    def setup_recurring_input(self):
+        """Build the recurrence input (left unpacked; on_schedule_change shows it)"""
+        self.recurring_frame = ctk.CTkFrame(self.scheduling_frame)
+        
+        ctk.CTkLabel(self.recurring_frame, text="🔁 Repeat:", font=ctk.CTkFont(size=14, weight="bold")).pack(anchor="w", padx=20, pady=(15, 5))
+        self.recurrence_entry = ctk.CTkEntry(
+            self.recurring_frame,
+            placeholder_text="e.g. every weekday at 09:00, or cron 0 9 * * 1-5",
+            height=35
+        )
+        self.recurrence_entry.pack(fill="x", padx=20, pady=(0, 15))
+    
+    def setup_datetime_picker(self):
+        """Build the date/time dropdowns and quick-time buttons (left unpacked; on_schedule_change shows them)"""
+        self.datetime_frame = ctk.CTkFrame(self.scheduling_frame)
         
         # Date picker section using dropdowns
         date_section = ctk.CTkFrame(self.datetime_frame, fg_color="transparent")
@@ -293,12 +474,6 @@ class WhatsAppGUI:
                      command=lambda: self.set_quick_time(60)).pack(side="left", padx=2)
         ctk.CTkButton(quick_buttons_frame, text="Now", width=60, height=25,
                      command=lambda: self.set_quick_time(0)).pack(side="left", padx=2)
-        
-        # Initially hide datetime frame
-        self.datetime_frame.pack_forget()
-        
-        # Add padding
-        ctk.CTkLabel(scheduling_frame, text="").pack(pady=10)
     
     def update_days(self, *args):
         """Update available days based on selected month and year"""
@@ -365,6 +540,19 @@ class WhatsAppGUI:
         )
         self.clear_button.pack(side="right")
         
+        self.cancel_scheduled_button = ctk.CTkButton(
+            inner_frame,
+            text="Cancel Scheduled",
+            command=self.cancel_scheduled,
+            height=45,
+            width=140,
+            fg_color="gray",
+            hover_color="darkgray",
+            font=ctk.CTkFont(size=14),
+            state="disabled"
+        )
+        self.cancel_scheduled_button.pack(side="right", padx=(0, 15))
+        
     def setup_status_section(self, parent):
         """Setup status display section"""
         status_frame = ctk.CTkFrame(parent)
@@ -385,6 +573,9 @@ class WhatsAppGUI:
         self.progress_bar.pack(fill="x")
         self.progress_bar.set(0)
         
+        self.countdown_label = ctk.CTkLabel(progress_frame, text="No messages scheduled", anchor="w")
+        self.countdown_label.pack(fill="x", pady=(5, 0))
+        
         # Status text area
         status_text_frame = ctk.CTkFrame(status_frame, fg_color="transparent")
         status_text_frame.pack(fill="both", expand=True, padx=20, pady=(10, 20))
@@ -394,16 +585,34 @@ class WhatsAppGUI:
         self.status_textbox.pack(fill="both", expand=True)
         
     def on_schedule_change(self):
-        """Handle schedule option change"""
+        """Handle schedule option change, building the chosen section on first use"""
         if self.schedule_var.get() == "schedule":
+            if self.datetime_frame is None:
+                self.setup_datetime_picker()
+            self.hide_section(self.recurring_frame)
             self.datetime_frame.pack(fill="x", padx=0, pady=(0, 15))
             self.send_button.configure(text=SCHEDULE_MESSAGE_TEXT)
+        elif self.schedule_var.get() == "recurring":
+            if self.recurring_frame is None:
+                self.setup_recurring_input()
+            self.hide_section(self.datetime_frame)
+            self.recurring_frame.pack(fill="x", padx=0, pady=(0, 15))
+            self.send_button.configure(text=SCHEDULE_MESSAGE_TEXT)
         else:
-            self.datetime_frame.pack_forget()
+            self.hide_section(self.datetime_frame)
+            self.hide_section(self.recurring_frame)
             self.send_button.configure(text=SEND_MESSAGE_TEXT)
     
+    def hide_section(self, frame):
+        """Unpack a lazily built section, if it has been built"""
+        if frame is not None:
+            frame.pack_forget()
+    
     def validate_inputs(self):
         """Validate all user inputs"""
+        import cron
+        from templates import TemplateError, compile_template
+        
         name = self.name_entry.get().strip()
         phone = self.phone_entry.get().strip()
         message = self.message_textbox.get("1.0", "end-1c").strip()
@@ -416,7 +625,7 @@ class WhatsAppGUI:
             messagebox.showerror(VALIDATION_ERROR_TITLE, "Please enter phone number")
             return False
             
-        if not re.match(r'^\+\d{10,15}$', phone):
+        if normalize(phone) is None:
             messagebox.showerror(VALIDATION_ERROR_TITLE, 
                                "Please enter a valid phone number with country code (e.g., +1234567890)")
             return False
@@ -425,15 +634,19 @@ class WhatsAppGUI:
             messagebox.showerror(VALIDATION_ERROR_TITLE, "Please enter a message")
             return False
             
+        try:
+            missing = compile_template(message).missing_fields({"name": name, "phone": phone})
+        except TemplateError as e:
+            messagebox.showerror(VALIDATION_ERROR_TITLE, f"{str(e)}. Use {{{{ and }}}} for literal braces.")
+            return False
+        if missing:
+            messagebox.showerror(VALIDATION_ERROR_TITLE,
+                               f"Unknown placeholder {{{missing[0]}}}; only {{name}} and {{phone}} are available")
+            return False
+            
         if self.schedule_var.get() == "schedule":
             try:
-                year = int(self.year_var.get())
-                month = int(self.month_var.get().split(' - ')[0])
-                day = int(self.day_var.get())
-                hour = int(self.hour_var.get())
-                minute = int(self.minute_var.get())
-                
-                scheduled_datetime = datetime(year, month, day, hour, minute)
+                scheduled_datetime = self.get_scheduled_datetime()
                 
                 if scheduled_datetime <= datetime.now():
                     messagebox.showerror(VALIDATION_ERROR_TITLE, "Scheduled time must be in the future")
@@ -443,6 +656,14 @@ class WhatsAppGUI:
                 messagebox.showerror(VALIDATION_ERROR_TITLE, f"Invalid date/time selection: {str(e)}")
                 return False
                 
+        if self.schedule_var.get() == "recurring":
+            try:
+                # Parsing alone accepts dates that never come, such as 31 April
+                cron.parse(self.recurrence_entry.get().strip()).next_after(datetime.now())
+            except cron.CronError as e:
+                messagebox.showerror(VALIDATION_ERROR_TITLE, f"Invalid schedule: {str(e)}")
+                return False
+                
         return True
     
     def update_status(self, message):
@@ -453,86 +674,320 @@ class WhatsAppGUI:
         self.status_textbox.see("end")
         self.root.update_idletasks()
     
+    @profiling.traced("gui.send_whatsapp_message")
     def send_whatsapp_message(self, recipient, message):
         """Send WhatsApp message using Twilio"""
+        if not self.client:
+            return False, "Failed to send message: Twilio client not initialized. Check your credentials."
+        return self.send_outbox_message(self.outbox.enqueue(recipient, message))
+    
+    def send_outbox_message(self, message_id):
+        """Send a message stored in the outbox and record the outcome"""
+        from bulk_sender import resend_check_since
+        
+        queued = self.outbox.claim_id(message_id)
+        if queued is None:
+            return False, "Message was already sent or cancelled"
         try:
             if not self.client:
                 raise TwilioConnectionError("Twilio client not initialized. Check your credentials.")
                 
-            message_obj = self.client.messages.create(
-                from_='whatsapp:+14155238886',
-                body=message,
-                to=f'whatsapp:{recipient}'
-            )
-            return True, f"Message sent successfully! SID: {message_obj.sid}"
+            sid = self.get_sender().send_one(queued.recipient, queued.body, queued.from_number,
+                                             resend_check_since(queued))
+            self.outbox.mark_sent(message_id, sid)
+            return True, f"Message sent successfully! SID: {sid}"
         except Exception as e:
-            return False, f"Failed to send message: {str(e)}"
+            self.outbox.mark_failed(message_id, e)
+            return False, self.describe_send_error(e)
+        finally:
+            self.outbox.flush()
     
-    def send_message_thread(self):
-        """Thread function for sending messages"""
-        try:
-            name = self.name_entry.get().strip()
-            phone = self.phone_entry.get().strip()
-            message = self.message_textbox.get("1.0", "end-1c").strip()
-            
-            if self.schedule_var.get() == "schedule":
-                year = int(self.year_var.get())
-                month = int(self.month_var.get().split(' - ')[0])
-                day = int(self.day_var.get())
-                hour = int(self.hour_var.get())
-                minute = int(self.minute_var.get())
-                
-                scheduled_datetime = datetime(year, month, day, hour, minute)
-                current_datetime = datetime.now()
-                time_difference = scheduled_datetime - current_datetime
-                delay_seconds = time_difference.total_seconds()
-                
-                self.update_status(f"Message scheduled for {name} at {scheduled_datetime.strftime('%Y-%m-%d %H:%M')}")
-                self.update_status(f"Waiting {int(delay_seconds)} seconds...")
-                
-                # Countdown with progress bar
-                for i in range(int(delay_seconds)):
-                    if not self.is_sending:
-                        self.update_status("Message sending cancelled")
-                        return
-                        
-                    remaining = int(delay_seconds) - i
-                    progress = i / delay_seconds
-                    self.progress_bar.set(progress)
-                    
-                    if remaining % 60 == 0 or remaining <= 10:
-                        self.update_status(f"Sending in {remaining} seconds...")
-                    
-                    time.sleep(1)
-                
-                self.progress_bar.set(1.0)
-            
-            # Send the message
-            self.update_status(f"Sending message to {name}...")
-            success, result = self.send_whatsapp_message(phone, message)
+    def get_sender(self):
+        """Return a BulkSender sharing this window's client, sender pool, suppression list,
+        rate limiter and retry policy"""
+        from bulk_sender import BulkSender
+        from status_receiver import STATUS_CALLBACK_URL
+        
+        return BulkSender(self.client, rate_limiter=self.rate_limiter, retry_policy=self.retry_policy,
+                          sender_pool=self.sender_pool, suppression=self.suppression,
+                          status_callback=STATUS_CALLBACK_URL)
+    
+    def describe_send_error(self, error):
+        """Format a send failure, noting whether it was retried"""
+        from retry import classify_error, PERMANENT
+        
+        if classify_error(error) == PERMANENT:
+            return f"Failed to send message: {str(error)}"
+        return f"Failed to send message after retrying: {str(error)}"
+    
+    def send_bulk_whatsapp_messages(self, messages, campaign=None):
+        """Send (recipient, message) pairs concurrently, yielding (recipient, success, result) as each finishes
+        
+        Recipients are cleaned first, so invalid numbers and exact repeats are never
+        queued. With a campaign key, recipients this campaign already queued or
+        sent are skipped.
+        """
+        if not self.client:
+            raise TwilioConnectionError("Twilio client not initialized. Check your credentials.")
             
-            if success:
-                self.update_status(f"✅ {result}")
-                messagebox.showinfo("Success", f"Message sent successfully to {name}!")
+        cleaner = PhoneCleaner()
+        self.outbox.enqueue_many(cleaner.clean_pairs(messages), idempotency_prefix=campaign)
+        self.root.after(0, self.update_status, f"Recipient list cleaned: {cleaner.report()}")
+        for result in self.get_sender().send_outbox(self.outbox):
+            if result.success:
+                yield result.recipient, True, f"Message sent successfully! SID: {result.result}"
             else:
-                self.update_status(f"❌ {result}")
-                messagebox.showerror("Error", result)
+                yield result.recipient, False, f"Failed to send message: {result.result}"
+    
+    def get_async_loop(self):
+        """Return the shared asyncio loop, starting its thread on first use"""
+        if self.async_loop is None:
+            import asyncio
+            self.async_loop = asyncio.new_event_loop()
+            threading.Thread(target=self.async_loop.run_forever, daemon=True).start()
+        return self.async_loop
+    
+    @profiling.traced("gui.send_whatsapp_message_async")
+    async def send_whatsapp_message_async(self, recipient, message):
+        """Send WhatsApp message using Twilio's async HTTP client"""
+        if not (self.account_sid and self.auth_token):
+            return False, "Failed to send message: Twilio client not initialized. Check your credentials."
+        return await self.send_outbox_message_async(self.outbox.enqueue(recipient, message))
+    
+    async def send_outbox_message_async(self, message_id):
+        """Async counterpart of send_outbox_message"""
+        from async_sender import AsyncSender
+        from bulk_sender import resend_check_since
+        from status_receiver import STATUS_CALLBACK_URL
+        
+        queued = self.outbox.claim_id(message_id)
+        if queued is None:
+            return False, "Message was already sent or cancelled"
+        try:
+            if not (self.account_sid and self.auth_token):
+                raise TwilioConnectionError("Twilio client not initialized. Check your credentials.")
                 
+            if self.async_sender is None:
+                self.async_sender = AsyncSender(self.account_sid, self.auth_token,
+                                                rate_limiter=self.rate_limiter,
+                                                retry_policy=self.retry_policy,
+                                                sender_pool=self.sender_pool,
+                                                suppression=self.suppression,
+                                                status_callback=STATUS_CALLBACK_URL)
+            sid = await self.async_sender.send_one(queued.recipient, queued.body, queued.from_number,
+                                                   resend_check_since(queued))
+            self.outbox.mark_sent(message_id, sid)
+            return True, f"Message sent successfully! SID: {sid}"
         except Exception as e:
-            error_msg = f"Error: {str(e)}"
-            self.update_status(f"❌ {error_msg}")
-            messagebox.showerror("Error", error_msg)
+            self.outbox.mark_failed(message_id, e)
+            return False, self.describe_send_error(e)
         finally:
-            # Reset UI
-            self.is_sending = False
-            button_text = SEND_MESSAGE_TEXT if self.schedule_var.get() == "immediate" else SCHEDULE_MESSAGE_TEXT
-            self.send_button.configure(text=button_text)
-            self.send_button.configure(state="normal")
-            self.clear_button.configure(state="normal")
-            self.progress_bar.set(0)
+            self.outbox.flush()
+    
+    async def send_message_async(self, name, message_id):
+        """Send an immediate message on the shared loop and report back on the Tk thread"""
+        success, result = await self.send_outbox_message_async(message_id)
+        self.root.after(0, self.finish_send, name, success, result)
+    
+    def resume_outbox(self):
+        """Restore scheduled messages and send anything an earlier run left queued, in the background"""
+        if not self.client:
+            return
+        
+        from recovery import recover_scheduled
+        
+        def drain():
+            recovered = recover_scheduled(self.outbox, self.scheduler, self.fire_scheduled_message)
+            self.root.after(0, self.restore_scheduled_jobs, recovered)
+            recurring = self.recurring.restore()
+            self.root.after(0, self.restore_recurring_jobs, recurring)
+            results = list(self.get_sender().send_outbox(self.outbox))
+            if results:
+                sent = sum(1 for result in results if result.success)
+                self.root.after(0, self.update_status,
+                                f"Sent {sent} of {len(results)} message(s) left over from a previous run")
+        
+        threading.Thread(target=drain, daemon=True).start()
+    
+    def finish_send(self, name, success, result):
+        """Report the outcome of an immediate send and reset the UI"""
+        if success:
+            self.update_status(f"✅ {result}")
+            messagebox.showinfo("Success", f"Message sent successfully to {name}!")
+        else:
+            self.update_status(f"❌ {result}")
+            messagebox.showerror("Error", result)
+        self.reset_send_ui()
+    
+    def reset_send_ui(self):
+        """Restore buttons and progress after a send finishes or is cancelled"""
+        self.is_sending = False
+        button_text = SEND_MESSAGE_TEXT if self.schedule_var.get() == "immediate" else SCHEDULE_MESSAGE_TEXT
+        self.send_button.configure(text=button_text)
+        self.send_button.configure(state="normal")
+        self.clear_button.configure(state="normal")
+        self.progress_bar.set(0)
+    
+    def get_scheduled_datetime(self):
+        """Return the datetime selected in the date/time pickers"""
+        year = int(self.year_var.get())
+        month = int(self.month_var.get().split(' - ')[0])
+        day = int(self.day_var.get())
+        hour = int(self.hour_var.get())
+        minute = int(self.minute_var.get())
+        return datetime(year, month, day, hour, minute)
+    
+    def schedule_whatsapp_message(self, name, phone, message, scheduled_datetime):
+        """Store a message in the outbox and hand its due time to the shared scheduler"""
+        due = scheduled_datetime.timestamp()
+        # Stored first so the message survives a crash or restart
+        message_id = self.outbox.enqueue(phone, message, send_at=due)
+        self.scheduler.schedule(due, self.fire_scheduled_message, message_id, job_id=message_id)
+        self.scheduled_jobs[message_id] = (name, scheduled_datetime, time.time())
+        self.cancel_scheduled_button.configure(state="normal")
+        
+        delay_seconds = due - time.time()
+        self.update_status(f"Message scheduled for {name} at {scheduled_datetime.strftime('%Y-%m-%d %H:%M')}")
+        self.update_status(f"Waiting {int(delay_seconds)} seconds...")
+        self.start_countdown()
+    
+    def restore_scheduled_jobs(self, recovered):
+        """Show messages restored from the outbox in the countdown, on the Tk thread"""
+        restored_at = time.time()
+        restored = 0
+        for message_id, recipient, send_at in recovered.scheduled:
+            # The scheduler has these already, so a due one may have fired first
+            if message_id in self.fired_jobs:
+                self.fired_jobs.discard(message_id)
+                continue
+            self.scheduled_jobs[message_id] = (recipient, datetime.fromtimestamp(send_at), restored_at)
+            restored += 1
+        if restored:
+            self.cancel_scheduled_button.configure(state="normal")
+            self.update_status(f"Restored {restored} scheduled message(s) from a previous run")
+            self.start_countdown()
+        if recovered.dropped:
+            self.update_status(f"Skipped {recovered.dropped} scheduled message(s) missed while the app was closed")
+    
+    def schedule_recurring_message(self, name, phone, message, expression):
+        """Store a recurring message and arm its next occurrence in the shared scheduler"""
+        recurring_id, fire_at = self.recurring.add(phone, message, expression)
+        job_id = self.recurring.job_id(recurring_id)
+        self.scheduled_jobs[job_id] = (name, datetime.fromtimestamp(fire_at), time.time())
+        self.cancel_scheduled_button.configure(state="normal")
+        
+        self.update_status(f"Recurring message for {name} set to '{expression}'")
+        self.update_status(f"First message at {datetime.fromtimestamp(fire_at).strftime('%Y-%m-%d %H:%M')}")
+        self.start_countdown()
+    
+    def restore_recurring_jobs(self, rows):
+        """Show recurring messages restored from the outbox in the countdown, on the Tk thread"""
+        restored_at = time.time()
+        for row in rows:
+            self.scheduled_jobs[self.recurring.job_id(row.id)] = (
+                row.recipient, datetime.fromtimestamp(row.next_fire_at), restored_at)
+        if rows:
+            self.cancel_scheduled_button.configure(state="normal")
+            self.update_status(f"Restored {len(rows)} recurring message(s) from a previous run")
+            self.start_countdown()
+    
+    def start_countdown(self):
+        """Start the countdown ticker if it is not already running"""
+        if self.countdown_after_id is None:
+            self.tick_countdown()
+    
+    def tick_countdown(self):
+        """Refresh countdown and progress for the next scheduled message, then re-arm
+
+        Runs on the Tk thread via after(), once per COUNTDOWN_TICK_MS for all
+        scheduled messages; the sends themselves are fired by the scheduler.
+        """
+        self.countdown_after_id = None
+        next_job = self.scheduler.peek()
+        if next_job is None or next_job[1] not in self.scheduled_jobs:
+            if not self.scheduled_jobs:
+                self.countdown_label.configure(text="No messages scheduled")
+                self.progress_bar.set(0)
+                self.last_countdown_logged = None
+                return
+        else:
+            due, message_id = next_job
+            name, scheduled_datetime, scheduled_at = self.scheduled_jobs[message_id]
+            if abs(scheduled_datetime.timestamp() - due) > 1:
+                # A recurring message moved on to its next occurrence
+                scheduled_at = time.time()
+                self.scheduled_jobs[message_id] = (name, datetime.fromtimestamp(due), scheduled_at)
+            remaining = max(0, int(due - time.time()))
+            total = max(due - scheduled_at, 1)
+            self.progress_bar.set(min(1.0, (time.time() - scheduled_at) / total))
+            self.countdown_label.configure(
+                text=f"{len(self.scheduled_jobs)} scheduled · next to {name} in "
+                     f"{timedelta(seconds=remaining)}")
+            
+            if (remaining % 60 == 0 or remaining <= 10) and \
+                    self.last_countdown_logged != (message_id, remaining):
+                self.last_countdown_logged = (message_id, remaining)
+                self.update_status(f"Sending in {remaining} seconds...")
+        
+        self.countdown_after_id = self.root.after(COUNTDOWN_TICK_MS, self.tick_countdown)
+    
+    def fire_scheduled_message(self, message_id):
+        """Send a due message; runs on a scheduler worker thread"""
+        success, result = self.send_outbox_message(message_id)
+        self.root.after(0, self.finish_scheduled_message, message_id, success, result)
+    
+    def finish_scheduled_message(self, message_id, success, result):
+        """Report the outcome of a scheduled send on the Tk thread"""
+        job = self.scheduled_jobs.pop(message_id, None)
+        if job is None:
+            self.fired_jobs.add(message_id)
+            name = "recipient"
+        else:
+            name = job[0]
+        if not self.scheduled_jobs:
+            self.cancel_scheduled_button.configure(state="disabled")
+        if success:
+            self.update_status(f"✅ {result}")
+            messagebox.showinfo("Success", f"Message sent successfully to {name}!")
+        else:
+            self.update_status(f"❌ {result}")
+            messagebox.showerror("Error", result)
+    
+    def fire_recurring_message(self, message_id):
+        """Send one occurrence of a recurring message; runs on a scheduler worker thread"""
+        success, result = self.send_outbox_message(message_id)
+        # Logged only, so a daily reminder does not pop up a dialog every day
+        self.root.after(0, self.update_status, f"🔁 {'✅' if success else '❌'} {result}")
+    
+    def cancel_scheduled(self):
+        """Cancel every scheduled and recurring message that has not been sent yet"""
+        cancelled = 0
+        for message_id in list(self.scheduled_jobs):
+            if isinstance(message_id, tuple):
+                self.recurring.cancel(message_id[1])
+                del self.scheduled_jobs[message_id]
+                cancelled += 1
+            elif self.scheduler.cancel(message_id):
+                self.outbox.cancel(message_id)
+                del self.scheduled_jobs[message_id]
+                cancelled += 1
+            else:
+                # Already fired; finish_scheduled_message reports the outcome
+                del self.scheduled_jobs[message_id]
+        if not self.scheduled_jobs:
+            self.cancel_scheduled_button.configure(state="disabled")
+        self.update_status(f"Cancelled {cancelled} scheduled message(s)")
     
     def send_message(self):
         """Handle send message button click"""
+        if not self.services_ready:
+            if self.startup_error:
+                self.update_status(f"❌ {self.startup_error}")
+                messagebox.showerror("Error", self.startup_error)
+            else:
+                self.update_status("Still starting up; try again in a moment")
+            return
+            
         if not self.validate_inputs():
             return
             
@@ -542,14 +997,38 @@ class WhatsAppGUI:
             self.update_status("Cancelling...")
             return
             
+        import asyncio
+        from templates import compile_template
+        
+        name = self.name_entry.get().strip()
+        phone = normalize(self.phone_entry.get().strip())
+        message = compile_template(self.message_textbox.get("1.0", "end-1c").strip()).render(
+            {"name": name, "phone": phone})
+        
+        if self.schedule_var.get() == "schedule":
+            # The shared scheduler fires the message; no thread waits for it
+            self.schedule_whatsapp_message(name, phone, message, self.get_scheduled_datetime())
+            return
+            
+        if self.schedule_var.get() == "recurring":
+            self.schedule_recurring_message(name, phone, message, self.recurrence_entry.get().strip())
+            return
+            
+        if not (self.account_sid and self.auth_token):
+            self.update_status("❌ Twilio client not initialized. Check your credentials.")
+            messagebox.showerror("Error", "Twilio client not initialized. Check your credentials.")
+            return
+            
         # Start sending
         self.is_sending = True
         self.send_button.configure(text="Cancel", fg_color="red", hover_color="darkred")
         self.clear_button.configure(state="disabled")
         
-        # Start thread for sending
-        thread = threading.Thread(target=self.send_message_thread, daemon=True)
-        thread.start()
+        # Immediate sends share one event loop instead of a thread per click
+        message_id = self.outbox.enqueue(phone, message)
+        self.update_status(f"Sending message to {name}...")
+        asyncio.run_coroutine_threadsafe(self.send_message_async(name, message_id),
+                                         self.get_async_loop())
     
     def clear_all(self):
         """Clear all input fields"""
@@ -557,14 +1036,15 @@ class WhatsAppGUI:
         self.phone_entry.delete(0, "end")
         self.message_textbox.delete("1.0", "end")
         
-        # Reset date and time to default (5 minutes from now)
-        future_time = datetime.now() + timedelta(minutes=5)
-        self.year_var.set(str(future_time.year))
-        self.month_var.set(f"{future_time.month:02d} - {calendar.month_name[future_time.month]}")
-        self.day_var.set(str(future_time.day).zfill(2))
-        self.hour_var.set(str(future_time.hour).zfill(2))
-        self.minute_var.set(str((future_time.minute // 5) * 5).zfill(2))
-        self.update_days()
+        # Reset date and time to default (5 minutes from now), if the picker was built
+        if self.datetime_frame is not None:
+            future_time = datetime.now() + timedelta(minutes=5)
+            self.year_var.set(str(future_time.year))
+            self.month_var.set(f"{future_time.month:02d} - {calendar.month_name[future_time.month]}")
+            self.day_var.set(str(future_time.day).zfill(2))
+            self.hour_var.set(str(future_time.hour).zfill(2))
+            self.minute_var.set(str((future_time.minute // 5) * 5).zfill(2))
+            self.update_days()
         
         # Clear status
         self.status_textbox.configure(state="normal")
@@ -582,5 +1062,7 @@ class WhatsAppGUI:
 
 
 if __name__ == "__main__":
+    # Opt-in timing spans and stack sampling (PROFILE=1 or --profile), reported at exit
+    profiling.enable_from_args()
     app = WhatsAppGUI()
     app.run()
@@ -1,39 +1,328 @@
-from twilio.rest import Client
 from datetime import datetime, timedelta
-import time
+import csv
 import dotenv
 import os
+import sys
+import threading
 
-# Load environment variables from .env file
+# Load environment variables from .env file (before the modules below read their settings)
 dotenv.load_dotenv()
 
+import profiling
+from phones import PhoneCleaner, invalid_reason, normalize
+
 # Twilio credentials
 account_sid = os.getenv("ACCOUNT_SID")
 auth_token = os.getenv("AUTH_TOKEN")
 
-client = Client(account_sid, auth_token)
+# twilio.rest, the senders, the outbox, the scheduler and the HTTP servers
+# cost a few hundred milliseconds to import and start, so each is imported
+# and built on first use through the get_* functions below rather than
+# before the first prompt
+_services = {}
+_services_lock = threading.RLock()
+
+
+# return the named service, building it on first use (once, even from many threads)
+def _service(name, build):
+    try:
+        return _services[name]
+    except KeyError:
+        pass
+    with _services_lock:
+        if name not in _services:
+            _services[name] = build()
+        return _services[name]
+
+
+# Pooled keep-alive transport sized to the bulk-send concurrency
+def get_client():
+    def build():
+        from transport import DEFAULT_MAX_WORKERS, build_client
+        return build_client(account_sid, auth_token, pool_size=DEFAULT_MAX_WORKERS)
+    return _service("client", build)
+
+
+# Paces every send per sender number and backs off when Twilio throttles
+def get_rate_limiter():
+    def build():
+        from rate_limiter import AdaptiveRateLimiter
+        return AdaptiveRateLimiter()
+    return _service("rate_limiter", build)
+
+
+# Retries temporary failures with backoff; permanent ones fail fast
+def get_retry_policy():
+    def build():
+        from retry import RetryPolicy
+        return RetryPolicy()
+    return _service("retry_policy", build)
+
+
+# Spreads recipients over the WHATSAPP_SENDERS numbers (the sandbox number by default)
+def get_sender_pool():
+    def build():
+        from sender_pool import SenderPool
+        return SenderPool(rate_limiter=get_rate_limiter())
+    return _service("sender_pool", build)
+
+
+# Numbers that opted out; checked before every send
+def get_suppression():
+    def build():
+        from suppression import SuppressionList
+        return SuppressionList()
+    return _service("suppression", build)
+
+
+# Sends on a thread pool through the shared client, limiter and sender numbers
+def get_sender():
+    def build():
+        from bulk_sender import BulkSender
+        from status_receiver import STATUS_CALLBACK_URL
+        return BulkSender(get_client(), rate_limiter=get_rate_limiter(),
+                          retry_policy=get_retry_policy(), sender_pool=get_sender_pool(),
+                          suppression=get_suppression(), status_callback=STATUS_CALLBACK_URL)
+    sender = _service("sender", build)
+    _start_servers()
+    return sender
+
+
+# Durable queue: every message is stored here before it is sent
+def get_outbox():
+    def build():
+        from outbox import Outbox
+        return Outbox()
+    return _service("outbox", build)
+
+
+# One timer thread fires every scheduled message
+def get_scheduler():
+    def build():
+        from scheduler import Scheduler
+        scheduler = Scheduler()
+        metrics_server = _services.get("metrics_server")
+        if metrics_server is not None:
+            metrics_server.watch(scheduler=scheduler)
+        return scheduler
+    scheduler = _service("scheduler", build)
+    _start_servers()
+    return scheduler
+
 
+# Recurring messages: one scheduler entry each, re-armed after every send
+def get_recurring():
+    def build():
+        from recurring import RecurringSchedules
+        return RecurringSchedules(get_outbox(), get_scheduler(), send_outbox_message)
+    return _service("recurring", build)
 
-# send Whatsapp message
+
+# Records delivered/read/failed callbacks when STATUS_CALLBACK_URL is set, and
+# serves send metrics on /metrics when METRICS_PORT is set; started with the
+# first sender or scheduler, as there is nothing to report before then
+def _start_servers():
+    if "metrics_server" in _services:
+        return
+
+    def status_receiver():
+        from status_receiver import start_status_receiver
+        return start_status_receiver(get_outbox(), auth_token)
+
+    # The scheduler's gauge is added here if it exists already, or by get_scheduler
+    def metrics_server():
+        from metrics import start_metrics_server
+        return start_metrics_server(get_outbox(), _services.get("scheduler"))
+    _service("status_receiver", status_receiver)
+    _service("metrics_server", metrics_server)
+
+
+# stop whichever HTTP servers were started
+def _stop_servers():
+    for name in ("status_receiver", "metrics_server"):
+        server = _services.get(name)
+        if server is not None:
+            server.stop()
+
+
+# send Whatsapp message; returns True if it was sent
+@profiling.traced("cli.send_whatsapp_message")
 def send_whatsapp_message(recipient, message):
+    return send_outbox_message(get_outbox().enqueue(recipient, message))
+
+
+# send one message stored in the outbox, record the outcome and return True if it was sent
+def send_outbox_message(message_id):
+    from bulk_sender import resend_check_since
+    from retry import classify_error, PERMANENT
+
+    outbox = get_outbox()
+    queued = outbox.claim_id(message_id)
+    if queued is None:
+        return False  # already sent or cancelled
     try:
-        message = client.messages.create(
-            from_='whatsapp:+14155238886',  # Twilio sandbox number
-            body=message,
-            to=f'whatsapp:{recipient}'
-        )
-        print(f"Message sent to {recipient}: {message.sid}")
+        sid = get_sender().send_one(queued.recipient, queued.body, queued.from_number,
+                                    resend_check_since(queued))
+        outbox.mark_sent(message_id, sid)
+        print(f"Message sent to {queued.recipient}: {sid}")
+        return True
     except Exception as e:
+        outbox.mark_failed(message_id, e)
+        if classify_error(e) == PERMANENT:
+            print(f"Failed to send message (not retried): {e}")
+        else:
+            print(f"Failed to send message after retrying: {e}")
+        return False
+    finally:
+        outbox.flush()
+
+
+# send many Whatsapp messages concurrently through the shared client
+# (max_workers defaults to BULK_MAX_WORKERS); with a campaign key, running the
+# same campaign again skips recipients it already queued or sent
+def send_bulk_whatsapp_messages(messages, max_workers=None, campaign=None):
+    cleaner = PhoneCleaner()
+    queued = get_outbox().enqueue_many(cleaner.clean_pairs(messages), idempotency_prefix=campaign)
+    print(f"Recipient list cleaned: {cleaner.report()}")
+    report_campaign(campaign, queued)
+    return drain_outbox(max_workers)
+
+
+# say how many messages a campaign run added, the rest being already queued or sent
+def report_campaign(campaign, queued):
+    if campaign:
+        print(f"Campaign {campaign}: {queued} new message(s) queued; "
+              "recipients already queued or sent by this campaign were skipped.")
+
+
+# campaign key for a template sent to a file: the same file contents and
+# template give the same key, so re-running a campaign does not resend it
+def campaign_key(path, template):
+    import hashlib
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    digest.update(b"\0" + template.encode("utf-8"))
+    return f"campaign-{digest.hexdigest()[:16]}"
+
+
+# send every due message in the outbox, claiming work in batches
+def drain_outbox(max_workers=None):
+    sent = 0
+    for result in get_sender().send_outbox(get_outbox(), max_workers=max_workers):
+        if result.success:
+            sent += 1
+            print(f"Message sent to {result.recipient}: {result.result}")
+        else:
+            print(f"Failed to send message to {result.recipient}: {result.result}")
+    return sent
+
+
+# an asyncio sender sharing the CLI's limiter, retry policy, sender numbers and opt-outs
+def _async_sender(**kwargs):
+    from async_sender import AsyncSender
+    from status_receiver import STATUS_CALLBACK_URL
+
+    _start_servers()
+    return AsyncSender(account_sid, auth_token, rate_limiter=get_rate_limiter(),
+                       retry_policy=get_retry_policy(), sender_pool=get_sender_pool(),
+                       suppression=get_suppression(), status_callback=STATUS_CALLBACK_URL,
+                       **kwargs)
+
+
+# send Whatsapp message from an asyncio event loop; returns True if it was sent
+async def send_whatsapp_message_async(recipient, message, sender=None):
+    from bulk_sender import resend_check_since
+
+    outbox = get_outbox()
+    message_id = outbox.enqueue(recipient, message)
+    queued = outbox.claim_id(message_id)
+    if queued is None:
+        return False  # another process holds it, or it was already sent
+    args = (queued.recipient, queued.body, queued.from_number, resend_check_since(queued))
+    try:
+        if sender is None:
+            async with _async_sender() as sender:
+                sid = await sender.send_one(*args)
+        else:
+            sid = await sender.send_one(*args)
+        outbox.mark_sent(message_id, sid)
+        print(f"Message sent to {queued.recipient}: {sid}")
+        return True
+    except Exception as e:
+        outbox.mark_failed(message_id, e)
         print(f"Failed to send message: {e}")
+        return False
+    finally:
+        outbox.flush()
 
 
+# send many Whatsapp messages from one event loop, capping requests in flight
+# (max_in_flight defaults to ASYNC_MAX_IN_FLIGHT)
+async def send_bulk_whatsapp_messages_async(messages, max_in_flight=None, campaign=None):
+    sent = 0
+    outbox = get_outbox()
+    options = {} if max_in_flight is None else {"max_in_flight": max_in_flight}
+    async with _async_sender(**options) as sender:
+        cleaner = PhoneCleaner()
+        queued = outbox.enqueue_many(cleaner.clean_pairs(messages), idempotency_prefix=campaign)
+        print(f"Recipient list cleaned: {cleaner.report()}")
+        report_campaign(campaign, queued)
+        async for result in sender.send_outbox(outbox):
+            if result.success:
+                sent += 1
+                print(f"Message sent to {result.recipient}: {result.result}")
+            else:
+                print(f"Failed to send message to {result.recipient}: {result.result}")
+    return sent
 
 # Ask user for the recipient's Name & phone number & message to recipient
 def get_recipient_info():
     name = input("Enter the recipient's name: ")
-    recipient_number = input("Enter the recipient's WhatsApp number (in the format +1234567890): ")
-    message = input(f"Enter the message you want to send {name}: ")
-    return name, recipient_number, message
+    while True:
+        raw_number = input("Enter the recipient's WhatsApp number (in the format +1234567890): ")
+        recipient_number = normalize(raw_number)
+        if recipient_number:
+            break
+        print(f"Invalid number ({invalid_reason(raw_number)}). Please include the country code.")
+    message = input(f"Enter the message you want to send {name} ({{name}} is replaced by the name): ")
+    return name, recipient_number, render_message(message, name, recipient_number)
+
+# fill {name} and {phone} placeholders for a single recipient
+def render_message(message, name, recipient_number):
+    from templates import TemplateError, render
+
+    try:
+        return render(message, {"name": name, "phone": recipient_number})
+    except TemplateError as e:
+        print(f"Message not personalized ({e}); sending it as typed.")
+        return message
+
+# send a {field} template to every row, e.g. rows from csv.DictReader
+# (campaign works as for send_bulk_whatsapp_messages)
+def send_personalized_messages(template, rows, recipient_field="phone", processes=0,
+                               campaign=None):
+    from templates import personalize
+
+    cleaner = PhoneCleaner()
+    rows = cleaner.clean_rows(rows, recipient_field)
+    # Bodies are rendered lazily while they are stored, never all held at once
+    queued = get_outbox().enqueue_many(personalize(template, rows, recipient_field, processes),
+                                       idempotency_prefix=campaign)
+    print(f"Recipient list cleaned: {cleaner.report()}")
+    report_campaign(campaign, queued)
+    return drain_outbox()
+
+# send a {field} template to every row of a CSV file with a header line; the
+# campaign key defaults to one derived from the file contents and template,
+# so running the same send again only reaches recipients not yet queued
+def send_personalized_csv(path, template, recipient_field="phone", processes=0, campaign=None):
+    campaign = campaign or campaign_key(path, template)
+    with open(path, newline="", encoding="utf-8") as f:
+        return send_personalized_messages(template, csv.DictReader(f), recipient_field, processes,
+                                          campaign)
 
 # parse the date & time and calculate the delay
 def schedule_message(name, recipient_number, message):
@@ -54,34 +343,131 @@ def schedule_message(name, recipient_number, message):
         else:
             print(f"Message will be sent to {name} in {delay_seconds:.0f} seconds.")
             print(f"Scheduled for: {scheduled_datetime.strftime('%Y-%m-%d %H:%M')}")
-            time.sleep(delay_seconds)
-            send_whatsapp_message(recipient_number, message)
+            # Stored before waiting so the message survives a crash or restart
+            message_id = get_outbox().enqueue(recipient_number, message,
+                                              send_at=scheduled_datetime.timestamp())
+            # Keyed by message id, like the jobs recover_scheduled restores
+            get_scheduler().schedule(scheduled_datetime.timestamp(), send_outbox_message, message_id,
+                                     job_id=message_id)
             return True
     except ValueError:
         print("Invalid date/time format. Please use YYYY-MM-DD for date and HH:MM for time.")
         return False
 
+# set up a message that repeats on a cron schedule
+def schedule_recurring_message(name, recipient_number, message):
+    import cron
+
+    expression = input("Enter the schedule (e.g. 'every weekday at 09:00' or cron '0 9 * * 1-5'): ")
+    try:
+        _, first_fire = get_recurring().add(recipient_number, message, expression)
+    except cron.CronError as e:
+        print(f"Invalid schedule: {e}")
+        return False
+    print(f"Recurring message to {name} set up ({expression}).")
+    print(f"First send: {datetime.fromtimestamp(first_fire).strftime('%Y-%m-%d %H:%M')}")
+    return True
+
+# restore scheduled messages and send anything an earlier run left queued
+def resume_outbox():
+    outbox = get_outbox()
+    # Nothing to resume: leave Twilio and the scheduler unloaded until the first send
+    if not outbox.has_unsent() and not outbox.active_recurring():
+        return
+    from recovery import recover_scheduled
+
+    recovered = recover_scheduled(outbox, get_scheduler(), send_outbox_message)
+    if recovered.scheduled:
+        print(f"Restored {len(recovered.scheduled)} scheduled message(s) from a previous run.")
+    if recovered.dropped:
+        print(f"Skipped {recovered.dropped} scheduled message(s) missed while the tool was closed.")
+    restored = get_recurring().restore()
+    if restored:
+        print(f"Restored {len(restored)} recurring message(s).")
+    sent = drain_outbox()
+    if sent:
+        print(f"Sent {sent} queued message(s) left over from a previous run.")
+
+# print each number in E.164 form or why it is invalid; True if all are valid
+def validate_numbers(numbers):
+    valid = True
+    for raw_number in numbers:
+        recipient_number = normalize(raw_number)
+        if recipient_number:
+            print(f"{raw_number}: {recipient_number}")
+        else:
+            print(f"{raw_number}: invalid ({invalid_reason(raw_number)})")
+            valid = False
+    return valid
+
+def parse_args(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Send WhatsApp messages through Twilio, "
+                                                 "interactively or from scripts.")
+    parser.add_argument("--profile", action="store_true",
+                        help="time sends and sample stacks, writing PROFILE_REPORT at exit")
+    parser.add_argument("--validate", nargs="+", metavar="NUMBER",
+                        help="check phone numbers and print them in E.164 form, then exit "
+                             "without contacting Twilio")
+    return parser.parse_args(argv)
+
 # Main execution function
-def main():
+def main(argv=None):
+    args = parse_args(argv)
+    
+    # Opt-in timing spans and stack sampling (PROFILE=1 or --profile), reported at exit
+    if args.profile or profiling.PROFILE_ENABLED:
+        profiling.enable()
+    
+    if args.validate:
+        return 0 if validate_numbers(args.validate) else 1
+    
     print("WhatsApp Automation Tool")
     print("=" * 30)
     
-    # Get recipient information
-    name, recipient_number, message = get_recipient_info()
+    # Deliver anything left over from a crashed or interrupted run
+    resume_outbox()
+    
+    while True:
+        # Get recipient information
+        name, recipient_number, message = get_recipient_info()
+        
+        # Ask if user wants to schedule the message
+        schedule_choice = input("Do you want to schedule this message? (y/n, or r for recurring): ").lower().strip()
+        
+        if schedule_choice == 'y' or schedule_choice == 'yes':
+            # Schedule the message
+            success = schedule_message(name, recipient_number, message)
+            if not success:
+                print("Failed to schedule message. Please try again.")
+        elif schedule_choice == 'r' or schedule_choice == 'recurring':
+            # Repeat the message on a schedule
+            success = schedule_recurring_message(name, recipient_number, message)
+            if not success:
+                print("Failed to schedule message. Please try again.")
+        else:
+            # Send immediately
+            send_whatsapp_message(recipient_number, message)
+        
+        another = input("Do you want to send another message? (y/n): ").lower().strip()
+        if another not in ('y', 'yes'):
+            break
     
-    # Ask if user wants to schedule the message
-    schedule_choice = input("Do you want to schedule this message? (y/n): ").lower().strip()
+    # Scheduled messages fire from the scheduler thread; stay alive until they have
+    scheduler = _services.get("scheduler")
+    pending = scheduler.pending_count() if scheduler is not None else 0
+    if pending:
+        print(f"Waiting for {pending} scheduled message(s)... Press Ctrl+C to quit; "
+              "unsent messages stay in the outbox.")
+        try:
+            # Short timeouts keep Ctrl+C responsive on Windows
+            while not scheduler.join(timeout=1):
+                pass
+        except KeyboardInterrupt:
+            print("\nStopped. Scheduled messages remain queued in the outbox.")
     
-    if schedule_choice == 'y' or schedule_choice == 'yes':
-        # Schedule the message
-        success = schedule_message(name, recipient_number, message)
-        if not success:
-            print("Failed to schedule message. Please try again.")
-    else:
-        # Send immediately
-        send_whatsapp_message(recipient_number, message)
+    _stop_servers()
 
 if __name__ == "__main__":
-    main()
-
-
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Shared helpers for sending WhatsApp messages through Twilio"""
+
+from profiling import traced
+
+# Recent messages to a recipient checked by find_sent_message
+SENT_LOOKUP_LIMIT = 20
+
+# Allowance for clock differences between this machine and Twilio's date_created
+CLOCK_SKEW = 60
+
+# Twilio sandbox number, used as the default sender
+SANDBOX_NUMBER = '+14155238886'
+
+
+def whatsapp_address(number):
+    """Return the number in Twilio's whatsapp:<E.164> address format"""
+    number = number.strip()
+    if number.startswith('whatsapp:'):
+        return number
+    return f'whatsapp:{number}'
+
+
+@traced("twilio.create")
+def create_message(client, recipient, body, from_=SANDBOX_NUMBER, **kwargs):
+    """Send a single WhatsApp message and return the Twilio message resource"""
+    return client.messages.create(
+        from_=whatsapp_address(from_),
+        body=body,
+        to=whatsapp_address(recipient),
+        **kwargs
+    )
+
+
+@traced("twilio.create")
+async def create_message_async(client, recipient, body, from_=SANDBOX_NUMBER, **kwargs):
+    """Async counterpart of create_message; the client must use an async HTTP client"""
+    return await client.messages.create_async(
+        from_=whatsapp_address(from_),
+        body=body,
+        to=whatsapp_address(recipient),
+        **kwargs
+    )
+
+
+def _match_sent(messages, body, since):
+    for message in messages:
+        created = message.date_created
+        if created is not None and created.timestamp() < since - CLOCK_SKEW:
+            break  # listed newest first; everything after is older
+        if message.body == body:
+            return message.sid
+    return None
+
+
+def find_sent_message(client, recipient, body, since):
+    """Return the SID of a message with this body created for the recipient since
+    the timestamp, or None
+
+    Used before retrying a send whose earlier attempt may have reached
+    Twilio, so an ambiguous timeout never turns into a second message.
+    """
+    messages = client.messages.list(to=whatsapp_address(recipient), page_size=SENT_LOOKUP_LIMIT,
+                                    limit=SENT_LOOKUP_LIMIT)
+    return _match_sent(messages, body, since)
+
+
+async def find_sent_message_async(client, recipient, body, since):
+    """Async counterpart of find_sent_message"""
+    messages = await client.messages.list_async(to=whatsapp_address(recipient),
+                                                page_size=SENT_LOOKUP_LIMIT,
+                                                limit=SENT_LOOKUP_LIMIT)
+    return _match_sent(messages, body, since)
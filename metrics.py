@@ -0,0 +1,377 @@
+"""Send-pipeline metrics exposed in the Prometheus text format
+
+Counters, gauges and histograms are aggregated per thread: each thread
+updates its own shard without taking a lock, and a scrape sums the
+shards.  Recording a send therefore costs a few dict updates and no
+contention between sender threads.  Shards of finished threads are
+folded into one retired shard at scrape time, so short-lived threads
+(one per GUI send) do not pile up.
+
+Set METRICS_PORT to serve them for Prometheus:
+
+    METRICS_PORT=9108        # then scrape http://127.0.0.1:9108/metrics
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+import time
+
+# Local port serving /metrics (0 = no endpoint; metrics are still recorded)
+DEFAULT_METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Interface the endpoint listens on
+DEFAULT_METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+# Histogram upper bounds in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LATENESS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 300.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class _Shard:
+    # One thread's values; only that thread writes to it
+    __slots__ = ("values", "histograms")
+
+    def __init__(self):
+        self.values = {}
+        self.histograms = {}
+
+    def merge(self, other):
+        # list() copies in one step, so a thread adding a key meanwhile cannot break the loop
+        for key, value in list(other.values.items()):
+            self.values[key] = self.values.get(key, 0) + value
+        for key, (counts, total) in list(other.histograms.items()):
+            mine = self.histograms.get(key)
+            if mine is None:
+                self.histograms[key] = [list(counts), total]
+            else:
+                mine[0] = [a + b for a, b in zip(mine[0], counts)]
+                mine[1] += total
+
+
+class Registry:
+    """Metric definitions plus the per-thread shards holding their values"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._shards = []  # (thread, shard)
+        self._retired = _Shard()
+        self._metrics = {}  # name -> metric, in definition order
+        self._collectors = []
+
+    def shard(self):
+        """Return the calling thread's shard, creating it on first use"""
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = _Shard()
+            with self._lock:
+                self._shards.append((threading.current_thread(), shard))
+            return shard
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already defined")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self._add(Counter(self, name, help_text, labels))
+
+    def gauge(self, name, help_text, labels=()):
+        return self._add(Gauge(self, name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._add(Histogram(self, name, help_text, labels, buckets))
+
+    def add_collector(self, collect):
+        """Call collect() at every scrape; it returns extra exposition lines
+
+        Used for values that live elsewhere, such as outbox queue depth.
+        """
+        self._collectors.append(collect)
+
+    def remove_collector(self, collect):
+        if collect in self._collectors:
+            self._collectors.remove(collect)
+
+    def snapshot(self):
+        """Return one shard with every thread's values summed"""
+        total = _Shard()
+        with self._lock:
+            live = []
+            for thread, shard in self._shards:
+                if thread.is_alive():
+                    live.append((thread, shard))
+                else:
+                    # A finished thread never writes again, so it is safe to fold in
+                    self._retired.merge(shard)
+            self._shards = live
+            total.merge(self._retired)
+            for _, shard in live:
+                total.merge(shard)
+        return total
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render(snapshot))
+        for collect in list(self._collectors):
+            try:
+                lines.extend(collect())
+            except Exception as e:
+                lines.append(f"# collector failed: {e}")
+        return "\n".join(lines) + "\n"
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, help_text, labels):
+        self.registry = registry
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self, snapshot):
+        lines = self._header()
+        for (name, labels), value in sorted(snapshot.values.items(), key=_sort_key):
+            if name == self.name:
+                lines.append(f"{name}{_label_text(self.labels, labels)} {_number(value)}")
+        if len(lines) == 2 and not self.labels:
+            lines.append(f"{self.name} 0")
+        return lines
+
+
+def _sort_key(item):
+    (name, labels), _ = item
+    return name, tuple(str(label) for label in labels)
+
+
+class Counter(_Metric):
+    """Monotonic count, optionally split by label values"""
+
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        values = self.registry.shard().values
+        key = (self.name, labels)
+        values[key] = values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """Value that goes up and down, kept as per-thread deltas
+
+    A thread may inc() and another dec(); the scrape adds the deltas up.
+    """
+
+    kind = "gauge"
+
+    def inc(self, *labels, amount=1):
+        values = self.registry.shard().values
+        key = (self.name, labels)
+        values[key] = values.get(key, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(_Metric):
+    """Distribution of observed values in fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, registry, name, help_text, labels, buckets):
+        super().__init__(registry, name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        histograms = self.registry.shard().histograms
+        key = (self.name, labels)
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        # bisect_left puts a value equal to a bound in that bound's bucket (le is inclusive)
+        histogram[0][bisect_left(self.buckets, value)] += 1
+        histogram[1] += value
+
+    def render(self, snapshot):
+        lines = self._header()
+        entries = sorted(((key, value) for key, value in snapshot.histograms.items()
+                          if key[0] == self.name), key=_sort_key)
+        for (_, labels), (counts, total) in entries:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(float(bound))
+                label_text = _label_text(self.labels + ("le",), labels + (le,))
+                lines.append(f"{self.name}_bucket{label_text} {cumulative}")
+            label_text = _label_text(self.labels, labels)
+            lines.append(f"{self.name}_sum{label_text} {_number(total)}")
+            lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+REGISTRY = Registry()
+
+SEND_SECONDS = REGISTRY.histogram(
+    "whatsapp_send_duration_seconds",
+    "Time to send one message, including retries and rate-limit waits", ("outcome",))
+SENDS = REGISTRY.counter(
+    "whatsapp_sends_total", "Messages sent or given up on", ("outcome",))
+SEND_ERRORS = REGISTRY.counter(
+    "whatsapp_send_errors_total", "Failed sends by Twilio error code, HTTP status or exception",
+    ("code",))
+RETRIES = REGISTRY.counter(
+    "whatsapp_send_retries_total", "Send attempts repeated after a retryable failure")
+IN_FLIGHT = REGISTRY.gauge(
+    "whatsapp_sends_in_flight", "Sends started and not yet finished")
+SCHEDULER_LATENESS = REGISTRY.histogram(
+    "whatsapp_scheduler_lateness_seconds", "How long after its due time a scheduled job started",
+    buckets=LATENESS_BUCKETS)
+
+
+def error_code(error):
+    """Label value for a failed send: Twilio code, else HTTP status, else exception name"""
+    code = getattr(error, "code", None)
+    if code is None:
+        code = getattr(error, "status", None)
+    return str(code) if code is not None else type(error).__name__
+
+
+@contextmanager
+def track_send():
+    """Record one send's duration, outcome and error code, and count it as in flight"""
+    IN_FLIGHT.inc()
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception as e:
+        SEND_SECONDS.observe(time.perf_counter() - started, "error")
+        SENDS.inc("error")
+        SEND_ERRORS.inc(error_code(e))
+        raise
+    else:
+        SEND_SECONDS.observe(time.perf_counter() - started, "ok")
+        SENDS.inc("ok")
+    finally:
+        IN_FLIGHT.dec()
+
+
+def outbox_collector(outbox):
+    """Return a collector reporting the outbox's messages by state (queue depth)"""
+    def collect():
+        lines = ["# HELP whatsapp_outbox_messages Messages in the outbox by state",
+                 "# TYPE whatsapp_outbox_messages gauge"]
+        for state, count in sorted(outbox.counts().items()):
+            lines.append(f'whatsapp_outbox_messages{{state="{_escape(state)}"}} {count}')
+        return lines
+    return collect
+
+
+def scheduler_collector(scheduler):
+    """Return a collector reporting how many jobs the scheduler holds"""
+    def collect():
+        return ["# HELP whatsapp_scheduled_jobs Scheduled jobs that have not fired yet",
+                "# TYPE whatsapp_scheduled_jobs gauge",
+                f"whatsapp_scheduled_jobs {scheduler.pending_count()}"]
+    return collect
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes every few seconds would flood the console
+
+
+class MetricsServer:
+    """Background HTTP server answering GET /metrics"""
+
+    def __init__(self, registry=REGISTRY, host=DEFAULT_METRICS_HOST, port=DEFAULT_METRICS_PORT):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """Start listening; raises OSError if the port is already taken"""
+        self._server = ThreadingHTTPServer((self.host, self.port), _MetricsHandler)
+        self._server.daemon_threads = True
+        self._server.registry = self.registry
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-http",
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def watch(self, outbox=None, scheduler=None):
+        """Add queue-depth gauges for an outbox and/or scheduler"""
+        if outbox is not None:
+            self.registry.add_collector(outbox_collector(outbox))
+        if scheduler is not None:
+            self.registry.add_collector(scheduler_collector(scheduler))
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+
+
+def start_metrics_server(outbox=None, scheduler=None, port=DEFAULT_METRICS_PORT):
+    """Start /metrics if a port is configured; return the server, or None
+
+    The outbox and scheduler, when given, add queue-depth gauges; nothing
+    is registered when no port is configured.  A scheduler built later can
+    be added with the server's watch().
+    """
+    if not port:
+        return None
+    try:
+        return MetricsServer(port=port).start().watch(outbox, scheduler)
+    except OSError as e:
+        print(f"Metrics endpoint not started on port {port}: {e}")
+        return None
@@ -0,0 +1,484 @@
+"""Durable SQLite outbox for queued and scheduled messages
+
+Every message is written to the outbox before it is sent, so nothing
+pending is lost if the process crashes or the machine reboots.  The
+database runs in WAL mode; bulk enqueues and send results are committed
+in batches, and senders claim pending work in batches too.
+
+Messages stored without a sender number are assigned one from the sender
+pool when they are sent.
+
+Several processes, on this host or others sharing the database file, can
+drain the same outbox.  A claim is a time-limited lease held by one
+Outbox instance and renewed in the background while it is alive; if its
+process dies, the lease runs out and the message returns to pending for
+another worker.  Results are only recorded by the current lease holder.
+
+Every message carries an idempotency key with a unique index on it, so
+enqueueing the same logical message twice (a retried bulk run, a
+recurring occurrence) stores it once.  A message claimed again after an
+interrupted attempt is checked against Twilio before it is resent (see
+BulkSender.send_one).
+
+Message states:
+    pending   -> waiting to be sent (possibly at a future send_at)
+    in_flight -> claimed by a sender under a lease
+    sent      -> accepted by Twilio, sid recorded
+    failed    -> gave up, error recorded
+"""
+
+from collections import namedtuple
+import itertools
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+# Location of the outbox database
+DEFAULT_OUTBOX_PATH = os.getenv("OUTBOX_PATH", "outbox.db")
+
+# Results buffered before they are committed together
+DEFAULT_COMMIT_EVERY = int(os.getenv("OUTBOX_COMMIT_EVERY", "500"))
+
+# Seconds a claimed message stays reserved for its worker without a renewal
+DEFAULT_LEASE_SECONDS = float(os.getenv("OUTBOX_LEASE_SECONDS", "300"))
+
+# WAL needs shared memory, so it only works for processes on one host;
+# use DELETE when workers on several hosts share the file over the network
+DEFAULT_JOURNAL_MODE = os.getenv("OUTBOX_JOURNAL_MODE", "WAL")
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+SENT = "sent"
+FAILED = "failed"
+
+OutboxMessage = namedtuple("OutboxMessage",
+                           ["id", "recipient", "body", "from_number", "send_at", "attempts"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    recipient TEXT NOT NULL,
+    body TEXT NOT NULL,
+    from_number TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    send_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    sid TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires_at REAL,
+    idempotency_key TEXT
+);
+CREATE INDEX IF NOT EXISTS messages_state_send_at ON messages (state, send_at);
+
+CREATE TABLE IF NOT EXISTS recurring (
+    id INTEGER PRIMARY KEY,
+    recipient TEXT NOT NULL,
+    body TEXT NOT NULL,
+    from_number TEXT,
+    expression TEXT NOT NULL,
+    next_fire_at REAL NOT NULL,
+    active INTEGER NOT NULL DEFAULT 1,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS recurring_active_next_fire ON recurring (active, next_fire_at);
+
+CREATE TABLE IF NOT EXISTS delivery_status (
+    sid TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    rank INTEGER NOT NULL,
+    error_code TEXT,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+# Twilio message statuses in lifecycle order; callbacks can arrive out of
+# order, so a status never overwrites one that is further along
+STATUS_RANKS = {
+    "accepted": 0, "scheduled": 0, "queued": 1, "sending": 2, "sent": 3,
+    "delivered": 4, "read": 5, "undelivered": 6, "failed": 6, "canceled": 6,
+}
+
+RecurringMessage = namedtuple("RecurringMessage",
+                              ["id", "recipient", "body", "from_number", "expression", "next_fire_at"])
+
+# Columns added after the first release, created on older databases at open
+_ADDED_COLUMNS = {"lease_owner": "TEXT", "lease_expires_at": "REAL", "idempotency_key": "TEXT"}
+
+_MESSAGE_COLUMNS = "id, recipient, body, from_number, send_at, attempts"
+_RECURRING_COLUMNS = "id, recipient, body, from_number, expression, next_fire_at"
+
+
+class Outbox:
+    """SQLite message queue shared by every thread in the process
+
+    Each instance claims work under its own lease owner id, so separate
+    processes (or separate Outbox objects) never hand out the same message.
+    """
+
+    def __init__(self, path=DEFAULT_OUTBOX_PATH, commit_every=DEFAULT_COMMIT_EVERY,
+                 lease_seconds=DEFAULT_LEASE_SECONDS, journal_mode=DEFAULT_JOURNAL_MODE):
+        self.path = path
+        self.commit_every = max(1, int(commit_every))
+        self.lease_seconds = float(lease_seconds)
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._key_counter = itertools.count()
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute(f"PRAGMA journal_mode={journal_mode}")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._lock = threading.RLock()
+        self._results = []
+        self._closed = threading.Event()
+        self._heartbeat = None
+
+    def _migrate(self):
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(messages)")}
+        for name, kind in _ADDED_COLUMNS.items():
+            if name not in columns:
+                self._conn.execute(f"ALTER TABLE messages ADD COLUMN {name} {kind}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS messages_state_lease "
+                           "ON messages (state, lease_expires_at)")
+        self._conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS messages_idempotency_key "
+                           "ON messages (idempotency_key)")
+
+    def close(self):
+        """Flush buffered results, stop renewing leases and close the database"""
+        self._closed.set()
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+    def _transaction(self, statements):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(self._conn)
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _new_key(self):
+        # Unique to this instance and increasing, so inserts append to the end of the key index
+        return f"{self.owner}:{next(self._key_counter)}"
+
+    def enqueue(self, recipient, body, send_at=None, from_number=None, idempotency_key=None):
+        """Durably store one message and return its id
+
+        If a message with the same idempotency key is already stored, it is
+        left alone and its id is returned.  Without a key a unique one is
+        generated.
+        """
+        now = time.time()
+        send_at = now if send_at is None else send_at
+        key = idempotency_key or self._new_key()
+
+        def insert(conn):
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO messages "
+                "(recipient, body, from_number, send_at, created_at, updated_at, idempotency_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (recipient, body, from_number, send_at, now, now, key))
+            if cursor.rowcount:
+                return cursor.lastrowid
+            return conn.execute("SELECT id FROM messages WHERE idempotency_key = ?",
+                                (key,)).fetchone()[0]
+
+        return self._transaction(insert)
+
+    def enqueue_many(self, messages, send_at=None, from_number=None, batch_size=5000,
+                     idempotency_prefix=None):
+        """Store (recipient, body) pairs, committing once per batch; return the count stored
+
+        With an idempotency_prefix (a campaign or file name, say), each
+        message is keyed by prefix and recipient, so running the same
+        campaign again skips recipients it already holds.
+        """
+        now = time.time()
+        send_at = now if send_at is None else send_at
+        count = 0
+        batch = []
+
+        def insert(conn):
+            before = conn.total_changes
+            conn.executemany(
+                "INSERT OR IGNORE INTO messages "
+                "(recipient, body, from_number, send_at, created_at, updated_at, idempotency_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", batch)
+            return conn.total_changes - before
+
+        for recipient, body in messages:
+            key = f"{idempotency_prefix}:{recipient}" if idempotency_prefix else self._new_key()
+            batch.append((recipient, body, from_number, send_at, now, now, key))
+            if len(batch) >= batch_size:
+                count += self._transaction(insert)
+                batch = []
+        if batch:
+            count += self._transaction(insert)
+        return count
+
+    def claim(self, limit=100, now=None):
+        """Lease up to limit due pending messages to this outbox and return them
+
+        Messages whose lease ran out (their worker died) are returned to
+        pending first, so they are picked up again here.
+        """
+        now = time.time() if now is None else now
+
+        def claim_due(conn):
+            self._expire_leases(conn, now)
+            rows = conn.execute(
+                f"SELECT {_MESSAGE_COLUMNS} FROM messages "
+                "WHERE state = ? AND send_at <= ? ORDER BY send_at LIMIT ?",
+                (PENDING, now, limit)).fetchall()
+            conn.executemany(
+                "UPDATE messages SET state = ?, attempts = attempts + 1, updated_at = ?, "
+                "lease_owner = ?, lease_expires_at = ? WHERE id = ?",
+                [(IN_FLIGHT, now, self.owner, now + self.lease_seconds, row[0]) for row in rows])
+            return [OutboxMessage(*row) for row in rows]
+
+        claimed = self._transaction(claim_due)
+        if claimed:
+            self._start_heartbeat()
+        return claimed
+
+    def claim_batches(self, batch_size=100):
+        """Yield due messages, claiming the next batch only when the previous one is used up"""
+        while True:
+            batch = self.claim(batch_size)
+            if not batch:
+                return
+            yield from batch
+
+    def claim_id(self, message_id):
+        """Claim one specific pending message; return None if it is not pending"""
+        now = time.time()
+
+        def claim_one(conn):
+            row = conn.execute(
+                f"SELECT {_MESSAGE_COLUMNS} FROM messages WHERE id = ? AND state = ?",
+                (message_id, PENDING)).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE messages SET state = ?, attempts = attempts + 1, updated_at = ?, "
+                "lease_owner = ?, lease_expires_at = ? WHERE id = ?",
+                (IN_FLIGHT, now, self.owner, now + self.lease_seconds, message_id))
+            return OutboxMessage(*row)
+
+        claimed = self._transaction(claim_one)
+        if claimed is not None:
+            self._start_heartbeat()
+        return claimed
+
+    def mark_sent(self, message_id, sid):
+        """Record a successful send (committed with the next batch)"""
+        self._add_result((SENT, sid, None, time.time(), message_id, self.owner))
+
+    def mark_failed(self, message_id, error):
+        """Record a failed send (committed with the next batch)"""
+        self._add_result((FAILED, None, str(error), time.time(), message_id, self.owner))
+
+    def _add_result(self, result):
+        with self._lock:
+            self._results.append(result)
+            if len(self._results) >= self.commit_every:
+                self.flush()
+
+    def flush(self):
+        """Commit all buffered send results"""
+        with self._lock:
+            if not self._results:
+                return
+            results, self._results = self._results, []
+            # Only the lease holder may record an outcome
+            self._transaction(lambda conn: conn.executemany(
+                "UPDATE messages SET state = ?, sid = ?, error = ?, updated_at = ?, "
+                "lease_owner = NULL, lease_expires_at = NULL WHERE id = ? AND lease_owner = ?",
+                results))
+
+    def _start_heartbeat(self):
+        with self._lock:
+            if self._heartbeat is None and not self._closed.is_set():
+                self._heartbeat = threading.Thread(target=self._renew_leases, daemon=True,
+                                                   name="outbox-lease")
+                self._heartbeat.start()
+
+    def _renew_leases(self):
+        # Renew well before expiry so a live worker never loses its claims
+        while not self._closed.wait(self.lease_seconds / 3):
+            try:
+                self.extend_leases()
+            except sqlite3.Error:
+                pass  # retried on the next beat; the lease still has time left
+
+    def extend_leases(self):
+        """Push back the expiry of every lease this outbox holds; return how many"""
+        now = time.time()
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE messages SET lease_expires_at = ? WHERE state = ? AND lease_owner = ?",
+            (now + self.lease_seconds, IN_FLIGHT, self.owner)).rowcount)
+
+    @staticmethod
+    def _expire_leases(conn, now):
+        return conn.execute(
+            "UPDATE messages SET state = ?, lease_owner = NULL, lease_expires_at = NULL, "
+            "updated_at = ? WHERE state = ? AND (lease_expires_at <= ? OR lease_expires_at IS NULL)",
+            (PENDING, now, IN_FLIGHT, now)).rowcount
+
+    def cancel(self, message_id):
+        """Drop a message that has not been claimed yet; return True if it was pending"""
+        return self._transaction(lambda conn: conn.execute(
+            "DELETE FROM messages WHERE id = ? AND state = ?",
+            (message_id, PENDING)).rowcount > 0)
+
+    def pending_schedule(self):
+        """Return (id, recipient, send_at) for every pending message, earliest first
+
+        Served from the (state, send_at) index, so restoring a large backlog
+        at startup does not read message bodies.
+        """
+        with self._lock:
+            return self._conn.execute(
+                "SELECT id, recipient, send_at FROM messages WHERE state = ? ORDER BY send_at",
+                (PENDING,)).fetchall()
+
+    def has_unsent(self):
+        """Return True if any message is pending or in flight (one index probe)"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT 1 FROM messages WHERE state IN (?, ?) LIMIT 1",
+                (PENDING, IN_FLIGHT)).fetchone() is not None
+
+    def reschedule(self, changes):
+        """Move pending messages to new send times, given (message_id, send_at) pairs"""
+        now = time.time()
+        self._transaction(lambda conn: conn.executemany(
+            "UPDATE messages SET send_at = ?, updated_at = ? WHERE id = ? AND state = ?",
+            [(send_at, now, message_id, PENDING) for message_id, send_at in changes]))
+
+    def drop(self, message_ids, reason):
+        """Mark pending messages failed without sending them"""
+        now = time.time()
+        self._transaction(lambda conn: conn.executemany(
+            "UPDATE messages SET state = ?, error = ?, updated_at = ? WHERE id = ? AND state = ?",
+            [(FAILED, reason, now, message_id, PENDING) for message_id in message_ids]))
+
+    def add_recurring(self, recipient, body, expression, next_fire_at, from_number=None):
+        """Store a recurring message and return its id"""
+        return self._transaction(lambda conn: conn.execute(
+            "INSERT INTO recurring (recipient, body, from_number, expression, next_fire_at, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (recipient, body, from_number, expression, next_fire_at, time.time())).lastrowid)
+
+    def active_recurring(self):
+        """Return every active recurring message, earliest next fire first"""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {_RECURRING_COLUMNS} FROM recurring WHERE active = 1 ORDER BY next_fire_at"
+            ).fetchall()
+        return [RecurringMessage(*row) for row in rows]
+
+    def record_recurring_fire(self, recurring_id, fire_at, next_fire_at):
+        """Queue one occurrence of a recurring message and advance its next fire time
+
+        Both happen in one transaction, and only if the stored next fire time
+        is still fire_at, so an occurrence is never queued twice.  Returns
+        the queued message id, or None if there was nothing to queue.
+        """
+        now = time.time()
+
+        def fire(conn):
+            row = conn.execute(
+                "SELECT recipient, body, from_number FROM recurring "
+                "WHERE id = ? AND active = 1 AND next_fire_at = ?",
+                (recurring_id, fire_at)).fetchone()
+            if row is None:
+                return None
+            conn.execute("UPDATE recurring SET next_fire_at = ? WHERE id = ?",
+                         (next_fire_at, recurring_id))
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO messages "
+                "(recipient, body, from_number, send_at, created_at, updated_at, idempotency_key) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                row + (now, now, now, f"recurring:{recurring_id}:{fire_at}"))
+            return cursor.lastrowid if cursor.rowcount else None
+
+        return self._transaction(fire)
+
+    def skip_recurring(self, recurring_id, fire_at, next_fire_at):
+        """Advance a recurring message past a missed occurrence without queueing it"""
+        self._transaction(lambda conn: conn.execute(
+            "UPDATE recurring SET next_fire_at = ? WHERE id = ? AND next_fire_at = ?",
+            (next_fire_at, recurring_id, fire_at)))
+
+    def cancel_recurring(self, recurring_id):
+        """Stop a recurring message; return True if it was active"""
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE recurring SET active = 0 WHERE id = ? AND active = 1",
+            (recurring_id,)).rowcount > 0)
+
+    def record_statuses(self, updates):
+        """Store (sid, status, error_code, timestamp) delivery updates in one transaction
+
+        Kept apart from the messages table so a callback that arrives before
+        its send result is committed is not lost.
+        """
+        rows = [(sid, status, STATUS_RANKS.get(status, 0), error_code, at)
+                for sid, status, error_code, at in updates]
+        self._transaction(lambda conn: conn.executemany(
+            "INSERT INTO delivery_status (sid, status, rank, error_code, updated_at) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT (sid) DO UPDATE SET "
+            "status = excluded.status, rank = excluded.rank, error_code = excluded.error_code, "
+            "updated_at = excluded.updated_at WHERE excluded.rank >= delivery_status.rank",
+            rows))
+
+    def delivery_status(self, sid):
+        """Return (status, error_code) last reported for a message SID, or None"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT status, error_code FROM delivery_status WHERE sid = ?", (sid,)).fetchone()
+
+    def unsettled_sids(self, since):
+        """Return the SIDs of messages sent since the timestamp whose delivery is not final
+
+        Final means read, failed, undelivered or canceled; delivered messages
+        are included because they can still be read.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT m.sid FROM messages m LEFT JOIN delivery_status d ON d.sid = m.sid "
+                "WHERE m.state = ? AND m.updated_at >= ? AND m.sid IS NOT NULL "
+                "AND COALESCE(d.rank, 0) < ?",
+                (SENT, since, STATUS_RANKS["read"])).fetchall()
+        return {row[0] for row in rows}
+
+    def delivery_counts(self):
+        """Return the number of sent messages in each reported delivery status"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT status, COUNT(*) FROM delivery_status GROUP BY status").fetchall()
+        return dict(rows)
+
+    def requeue_expired(self):
+        """Return messages whose lease ran out (their process died) to pending
+
+        Messages still leased by a live worker are left alone.
+        """
+        return self._transaction(lambda conn: self._expire_leases(conn, time.time()))
+
+    def counts(self):
+        """Return the number of messages in each state"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM messages GROUP BY state").fetchall()
+        return dict(rows)
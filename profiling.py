@@ -0,0 +1,362 @@
+"""Opt-in profiling of the send path, scheduler and template rendering
+
+Turned on with PROFILE=1 or the --profile flag of the CLI, GUI and
+worker.py.  While on:
+
+- timing spans are recorded around each send, the Twilio create call,
+  rate-limit waits, scheduler jobs and template rendering;
+- every HTTP request is split into phases: DNS lookup, connect (TCP and
+  TLS), TLS handshake on its own, sending the request and waiting for
+  the response;
+- a sampler thread records every thread's stack at a fixed interval, so
+  time can be attributed to Twilio (threads blocked in socket reads),
+  our own worker threads or the GUI main loop.
+
+A report is written to PROFILE_REPORT when the process exits, plus a
+``.folded`` file of sampled stacks for flame graph tools.  When profiling
+is off, span() hands back a shared no-op context manager and nothing is
+patched.
+"""
+
+from collections import Counter, defaultdict
+from functools import wraps
+import atexit
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+# Profile from startup without the --profile flag
+PROFILE_ENABLED = os.getenv("PROFILE", "").lower() not in ("", "0", "false", "no")
+
+# Report written at exit; sampled stacks go next to it with a .folded suffix
+DEFAULT_REPORT_PATH = os.getenv("PROFILE_REPORT", "profile_report.txt")
+
+# Seconds between stack samples of every thread
+DEFAULT_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))
+
+# Durations kept per span for percentiles; later ones replace kept ones at random
+RESERVOIR_SIZE = 100_000
+
+# Longest stacks kept per sample
+MAX_STACK_DEPTH = 64
+
+# inspect.CO_COROUTINE; importing inspect would add ~10 ms to every startup
+_CO_COROUTINE = 0x0080
+
+enabled = False
+
+_lock = threading.Lock()
+_spans = {}  # name -> [count, total, max, reservoir]
+_samples = Counter()  # (thread group, stack) -> samples
+_sampler = None
+_stop_sampling = threading.Event()
+_report_path = DEFAULT_REPORT_PATH
+_started = None
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "started")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.perf_counter() - self.started)
+        return False
+
+
+def record(name, seconds):
+    """Add one duration to the named span"""
+    with _lock:
+        stats = _spans.get(name)
+        if stats is None:
+            stats = _spans[name] = [0, 0.0, 0.0, []]
+        stats[0] += 1
+        stats[1] += seconds
+        if seconds > stats[2]:
+            stats[2] = seconds
+        reservoir = stats[3]
+        if len(reservoir) < RESERVOIR_SIZE:
+            reservoir.append(seconds)
+        else:
+            slot = random.randrange(stats[0])
+            if slot < RESERVOIR_SIZE:
+                reservoir[slot] = seconds
+
+
+def span(name):
+    """Context manager timing its body under name (a no-op unless profiling)"""
+    return _Span(name) if enabled else _NULL_SPAN
+
+
+def traced(name):
+    """Decorator timing every call of a function or coroutine function under name"""
+    def decorate(func):
+        if getattr(func, "__code__", None) and func.__code__.co_flags & _CO_COROUTINE:
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if not enabled:
+                    return await func(*args, **kwargs)
+                with _Span(name):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def timed_iter(name, iterable):
+    """Wrap a lazy iterable so the time spent producing its items is recorded under name
+
+    Recorded once, when the iterable is exhausted or closed; returned
+    unchanged when profiling is off.
+    """
+    if not enabled:
+        return iterable
+    return _timed_iter(name, iterable)
+
+
+def _timed_iter(name, iterable):
+    iterator = iter(iterable)
+    spent = 0.0
+    clock = time.perf_counter
+    try:
+        while True:
+            started = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                spent += clock() - started
+                return
+            spent += clock() - started
+            yield item
+    finally:
+        record(name, spent)
+
+
+def _timed(name, func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            record(name, time.perf_counter() - started)
+    wrapper.__profiled__ = True
+    return wrapper
+
+
+def _patch(owner, attribute, name):
+    func = getattr(owner, attribute, None)
+    if func is not None and not getattr(func, "__profiled__", False):
+        setattr(owner, attribute, _timed(name, func))
+
+
+def _instrument_http():
+    # getaddrinfo is looked up on the socket module at call time by urllib3
+    # and by aiohttp's threaded resolver, so one patch covers both
+    _patch(socket, "getaddrinfo", "http.dns")
+    try:
+        import urllib3.connection as connection
+    except ImportError:
+        return
+    _patch(connection.HTTPConnection, "_new_conn", "http.connect")
+    _patch(connection, "_ssl_wrap_socket_and_match_hostname", "http.tls")
+    _patch(connection.HTTPConnection, "request", "http.request")
+    _patch(connection.HTTPConnection, "getresponse", "http.response")
+
+
+def aiohttp_trace_configs():
+    """Return trace configs splitting aiohttp requests into the same phases (empty when off)
+
+    aiohttp does not report the TLS handshake separately; it is part of
+    http.connect.
+    """
+    if not enabled:
+        return []
+    import aiohttp
+
+    def phase(name, start_key):
+        async def end(session, ctx, params):
+            started = getattr(ctx, start_key, None)
+            if started is not None:
+                record(name, time.perf_counter() - started)
+        return end
+
+    def mark(key):
+        async def start(session, ctx, params):
+            setattr(ctx, key, time.perf_counter())
+        return start
+
+    trace = aiohttp.TraceConfig()
+    trace.on_connection_create_start.append(mark("connect_started"))
+    trace.on_connection_create_end.append(phase("http.connect", "connect_started"))
+    trace.on_request_start.append(mark("request_started"))
+    trace.on_request_headers_sent.append(phase("http.request", "request_started"))
+    trace.on_request_headers_sent.append(mark("headers_sent"))
+    trace.on_request_end.append(phase("http.response", "headers_sent"))
+    return [trace]
+
+
+def _thread_group(name):
+    # "bulk-send_3" and "Thread-12 (_run)" fold into their pool or target
+    base = name.rsplit("_", 1)[0] if name.rsplit("_", 1)[-1].isdigit() else name
+    if base.startswith("Thread-") and " (" in base:
+        base = "Thread (" + base.split(" (", 1)[1]
+    return base
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+
+def _sample(interval):
+    own = threading.get_ident()
+    while not _stop_sampling.wait(interval):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        frames = sys._current_frames()
+        batch = []
+        for ident, frame in frames.items():
+            if ident == own:
+                continue
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.reverse()
+            batch.append((_thread_group(names.get(ident, str(ident))), tuple(stack)))
+        del frames
+        with _lock:
+            _samples.update(batch)
+
+
+def enable(report_path=None, sample_interval=DEFAULT_SAMPLE_INTERVAL):
+    """Start profiling this process and write the report at exit"""
+    global enabled, _sampler, _report_path, _started
+    if enabled:
+        return
+    enabled = True
+    _started = time.perf_counter()
+    if report_path:
+        _report_path = report_path
+    _instrument_http()
+    if sample_interval > 0:
+        _sampler = threading.Thread(target=_sample, args=(sample_interval,),
+                                    name="profile-sampler", daemon=True)
+        _sampler.start()
+    atexit.register(write_report)
+    print(f"Profiling on; report will be written to {_report_path}")
+
+
+def enable_from_args(argv=None, report_path=None):
+    """Enable profiling if PROFILE is set or --profile is in argv (which is removed)
+
+    Returns True if profiling is on.
+    """
+    argv = sys.argv if argv is None else argv
+    flagged = "--profile" in argv
+    if flagged:
+        argv.remove("--profile")
+    if flagged or PROFILE_ENABLED:
+        enable(report_path)
+    return enabled
+
+
+def _percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def _span_lines(spans):
+    lines = [f"{'span':<32}{'count':>9}{'total s':>11}{'mean ms':>10}"
+             f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}"]
+    for name, (count, total, maximum, reservoir) in sorted(spans.items(),
+                                                           key=lambda item: -item[1][1]):
+        ordered = sorted(reservoir)
+        lines.append(f"{name:<32}{count:>9}{total:>11.3f}{total / count * 1000:>10.2f}"
+                     f"{_percentile(ordered, 0.5) * 1000:>10.2f}"
+                     f"{_percentile(ordered, 0.95) * 1000:>10.2f}"
+                     f"{_percentile(ordered, 0.99) * 1000:>10.2f}{maximum * 1000:>10.2f}")
+    return lines
+
+
+def _sample_lines(samples, top=25):
+    total = sum(samples.values())
+    if not total:
+        return ["No stack samples were taken."]
+    by_group = Counter()
+    self_time = Counter()
+    inclusive = Counter()
+    waiting = defaultdict(int)
+    for (group, stack), count in samples.items():
+        by_group[group] += count
+        if stack:
+            self_time[stack[-1]] += count
+            # Count each function once per stack, however deep the recursion
+            for label in set(stack):
+                inclusive[label] += count
+            if stack[-1].startswith(("socket.py:", "ssl.py:", "selectors.py:")):
+                waiting[group] += count
+
+    lines = [f"{total} samples", "", "Samples by thread (share of samples; 'in I/O' = blocked "
+             "on the network):"]
+    for group, count in by_group.most_common():
+        lines.append(f"  {group:<40}{count / total:>7.1%}   in I/O {waiting[group] / count:>6.1%}")
+    lines += ["", f"Top {top} functions by own samples:"]
+    lines += [f"  {count / total:>7.1%}  {label}" for label, count in self_time.most_common(top)]
+    lines += ["", f"Top {top} functions by samples including callees:"]
+    lines += [f"  {count / total:>7.1%}  {label}" for label, count in inclusive.most_common(top)]
+    return lines
+
+
+def write_report(path=None):
+    """Write the span and sampling report; return its path"""
+    path = path or _report_path
+    atexit.unregister(write_report)
+    _stop_sampling.set()
+    if _sampler is not None:
+        _sampler.join()
+    with _lock:
+        spans = {name: list(stats) for name, stats in _spans.items()}
+        samples = Counter(_samples)
+
+    elapsed = time.perf_counter() - _started if _started is not None else 0.0
+    lines = [f"Profile of pid {os.getpid()} over {elapsed:.1f}s", "",
+             "Timing spans (http.connect includes http.dns and http.tls):"]
+    lines += _span_lines(spans) if spans else ["  none recorded"]
+    lines += ["", "Stack samples:"]
+    lines += _sample_lines(samples)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+    # One "thread;frame;frame count" line per stack, the input flamegraph.pl and speedscope read
+    with open(path + ".folded", "w", encoding="utf-8") as f:
+        for (group, stack), count in samples.items():
+            f.write(";".join((group,) + stack) + f" {count}\n")
+    print(f"Profile report written to {path}")
+    return path
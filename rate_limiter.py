@@ -0,0 +1,169 @@
+"""Adaptive per-sender rate limiting for outgoing messages
+
+Each sender number gets its own token bucket.  Successful sends raise the
+bucket's rate additively; 429s and Twilio queue-overflow errors cut it
+multiplicatively (AIMD), so throughput settles just below the ceiling
+Twilio actually allows.  Throttled messages were never accepted by Twilio;
+the senders' RetryPolicy (which treats throttling as retryable) sends them
+again, and the retry waits for a token from the slowed-down bucket.
+"""
+
+import asyncio
+import os
+import threading
+import time
+
+from profiling import span
+
+# Starting messages-per-second for each sender
+DEFAULT_RATE = float(os.getenv("SEND_RATE_PER_SENDER", "10"))
+
+# Upper bound the additive increase can reach
+DEFAULT_MAX_RATE = float(os.getenv("SEND_MAX_RATE_PER_SENDER", "80"))
+
+# HTTP status and Twilio error codes that mean "slow down"
+THROTTLE_STATUS = 429
+THROTTLE_CODES = {
+    20429,  # Too Many Requests
+    21611,  # Sender has exceeded its queue of pending messages
+}
+
+
+def is_throttle_error(error):
+    """Return True if the exception is Twilio telling us to send slower"""
+    return (getattr(error, "status", None) == THROTTLE_STATUS
+            or getattr(error, "code", None) in THROTTLE_CODES)
+
+
+class TokenBucket:
+    """Token bucket that hands out send slots at a configurable rate
+
+    Not thread-safe on its own; AdaptiveRateLimiter guards it with a lock.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(1.0, rate))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """Take one token and return how many seconds the caller must wait for it
+
+        Tokens can go negative, so concurrent callers queue up in order
+        instead of all waking at the same moment.
+        """
+        self._refill()
+        self.tokens -= 1
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def set_rate(self, rate):
+        """Change the refill rate, keeping the bucket's current fill level"""
+        self._refill()
+        self.rate = float(rate)
+        self.burst = max(1.0, self.rate)
+
+
+class AdaptiveRateLimiter:
+    """Per-sender token buckets with additive increase, multiplicative decrease"""
+
+    def __init__(self, rate=DEFAULT_RATE, min_rate=0.5, max_rate=DEFAULT_MAX_RATE,
+                 increase=0.1, decrease=0.5, cooldown=1.0):
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.max_rate = float(max_rate)
+        self.increase = float(increase)
+        self.decrease = float(decrease)
+        self.cooldown = float(cooldown)
+        self._buckets = {}
+        self._last_decrease = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, sender):
+        bucket = self._buckets.get(sender)
+        if bucket is None:
+            bucket = self._buckets[sender] = TokenBucket(self.rate)
+        return bucket
+
+    def current_rate(self, sender):
+        """Return the sender's current messages-per-second rate"""
+        with self._lock:
+            return self._bucket(sender).rate
+
+    def reserve(self, sender):
+        """Reserve a send slot for the sender and return the delay before using it"""
+        with self._lock:
+            return self._bucket(sender).reserve()
+
+    def acquire(self, sender):
+        """Block until the sender may send one message"""
+        delay = self.reserve(sender)
+        if delay > 0:
+            with span("rate_limiter.wait"):
+                time.sleep(delay)
+
+    async def acquire_async(self, sender):
+        """Wait on the event loop until the sender may send one message"""
+        delay = self.reserve(sender)
+        if delay > 0:
+            with span("rate_limiter.wait"):
+                await asyncio.sleep(delay)
+
+    def on_success(self, sender):
+        """Additive increase after an accepted message"""
+        with self._lock:
+            bucket = self._bucket(sender)
+            if bucket.rate < self.max_rate:
+                bucket.set_rate(min(self.max_rate, bucket.rate + self.increase))
+
+    def on_throttle(self, sender):
+        """Multiplicative decrease after a throttling error
+
+        A burst of throttled responses from the same window only cuts the
+        rate once per cooldown period.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_decrease.get(sender, 0.0) < self.cooldown:
+                return
+            self._last_decrease[sender] = now
+            bucket = self._bucket(sender)
+            bucket.set_rate(max(self.min_rate, bucket.rate * self.decrease))
+            # Drain the bucket so queued callers back off straight away
+            bucket.tokens = min(bucket.tokens, 0.0)
+
+    def call(self, sender, func, *args, **kwargs):
+        """Call func once under the sender's rate limit and adapt the rate to the outcome
+
+        Throttling errors slow the sender down and are re-raised; resending
+        is left to the caller's RetryPolicy, so a throttled message is
+        retried by one layer only and within the policy's deadline.
+        """
+        self.acquire(sender)
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if is_throttle_error(e):
+                self.on_throttle(sender)
+            raise
+        self.on_success(sender)
+        return result
+
+    async def call_async(self, sender, func, *args, **kwargs):
+        """Async counterpart of call for coroutine functions"""
+        await self.acquire_async(sender)
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as e:
+            if is_throttle_error(e):
+                self.on_throttle(sender)
+            raise
+        self.on_success(sender)
+        return result
@@ -0,0 +1,104 @@
+"""Bulk delivery-status reconciliation through the Messages list API
+
+When status callbacks cannot reach us, statuses can still be caught up
+by paging through the account's messages, 1000 per request, filtered by
+sender and send date, and keeping the ones whose SIDs we sent.  One page
+replaces a thousand ``messages(sid).fetch()`` calls, and paging stops as
+soon as every outstanding SID has been seen.
+
+    python reconcile.py                # messages sent in the last 24 hours
+    python reconcile.py --hours 72
+"""
+
+from collections import namedtuple
+from datetime import datetime, timezone
+import argparse
+import os
+import time
+
+import dotenv
+
+# Load environment variables from .env file (before the modules below read their settings)
+dotenv.load_dotenv()
+
+from messaging import whatsapp_address
+from outbox import Outbox
+from sender_pool import SenderPool
+from transport import build_client
+
+# Largest page the Messages list API returns
+MAX_PAGE_SIZE = 1000
+
+# How far back reconciliation looks by default
+DEFAULT_LOOKBACK_HOURS = float(os.getenv("RECONCILE_LOOKBACK_HOURS", "24"))
+
+# Twilio's date_sent can be slightly earlier than when we recorded the send
+DATE_SENT_SLACK = 300
+
+# checked: messages read from the API; updated: statuses stored;
+# missing: our SIDs that were not found in the listed range
+ReconcileResult = namedtuple("ReconcileResult", ["checked", "updated", "missing"])
+
+
+def reconcile(client, outbox, since=None, senders=None, page_size=MAX_PAGE_SIZE, batch_size=1000):
+    """Update the delivery status of every unsettled message sent since the timestamp
+
+    senders is a list of sender numbers to filter on (one listing per
+    sender); None lists every message in the account.
+    """
+    since = time.time() - DEFAULT_LOOKBACK_HOURS * 3600 if since is None else since
+    wanted = outbox.unsettled_sids(since)
+    if not wanted:
+        return ReconcileResult(0, 0, 0)
+
+    date_sent_after = datetime.fromtimestamp(since - DATE_SENT_SLACK, timezone.utc)
+    filters = [{"from_": whatsapp_address(number)} for number in senders] if senders else [{}]
+    checked = updated = 0
+    batch = []
+
+    for filter_args in filters:
+        for message in client.messages.stream(date_sent_after=date_sent_after,
+                                              page_size=page_size, **filter_args):
+            checked += 1
+            if message.sid not in wanted:
+                continue
+            wanted.discard(message.sid)
+            error_code = str(message.error_code) if message.error_code else None
+            batch.append((message.sid, str(message.status), error_code, time.time()))
+            if len(batch) >= batch_size:
+                outbox.record_statuses(batch)
+                updated += len(batch)
+                batch = []
+            if not wanted:
+                break
+        if not wanted:
+            break
+
+    if batch:
+        outbox.record_statuses(batch)
+        updated += len(batch)
+    return ReconcileResult(checked, updated, len(wanted))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fetch delivery statuses for recently sent messages")
+    parser.add_argument("--hours", type=float, default=DEFAULT_LOOKBACK_HOURS,
+                        help="look at messages sent in the last N hours (default %(default)s)")
+    parser.add_argument("--all-senders", action="store_true",
+                        help="list every message in the account instead of filtering by WHATSAPP_SENDERS")
+    args = parser.parse_args()
+
+    client = build_client(os.getenv("ACCOUNT_SID"), os.getenv("AUTH_TOKEN"))
+    outbox = Outbox()
+    try:
+        senders = None if args.all_senders else SenderPool().numbers
+        result = reconcile(client, outbox, since=time.time() - args.hours * 3600, senders=senders)
+        print(f"Checked {result.checked} message(s), updated {result.updated} status(es), "
+              f"{result.missing} not found")
+        print(f"Delivery statuses: {outbox.delivery_counts()}")
+    finally:
+        outbox.close()
+
+
+if __name__ == "__main__":
+    main()
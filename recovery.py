@@ -0,0 +1,88 @@
+"""Restore scheduled messages from the outbox after a restart
+
+Pending messages whose send time is still ahead go back into the
+scheduler.  Messages whose send time passed while the app was closed are
+handled by a catch-up policy:
+
+    immediate -> send them all now
+    spread    -> send them evenly over the next CATCHUP_WINDOW_MINUTES
+    drop      -> skip any missed by more than CATCHUP_MAX_AGE_MINUTES,
+                 send the rest now
+"""
+
+from collections import namedtuple
+import os
+import time
+
+CATCHUP_IMMEDIATE = "immediate"
+CATCHUP_SPREAD = "spread"
+CATCHUP_DROP = "drop"
+
+DEFAULT_CATCHUP_POLICY = os.getenv("CATCHUP_POLICY", CATCHUP_IMMEDIATE)
+DEFAULT_CATCHUP_WINDOW_MINUTES = float(os.getenv("CATCHUP_WINDOW_MINUTES", "10"))
+DEFAULT_CATCHUP_MAX_AGE_MINUTES = float(os.getenv("CATCHUP_MAX_AGE_MINUTES", "60"))
+
+# What recover_scheduled did: scheduled holds (message_id, recipient, send_at)
+# for every job handed to the scheduler; due is the number left for an
+# immediate outbox drain
+RecoveryResult = namedtuple("RecoveryResult", ["scheduled", "due", "dropped"])
+
+
+class CatchupPolicy:
+    """Decide what happens to messages whose send time passed while the app was closed"""
+
+    def __init__(self, mode=DEFAULT_CATCHUP_POLICY, window_minutes=DEFAULT_CATCHUP_WINDOW_MINUTES,
+                 max_age_minutes=DEFAULT_CATCHUP_MAX_AGE_MINUTES):
+        if mode not in (CATCHUP_IMMEDIATE, CATCHUP_SPREAD, CATCHUP_DROP):
+            raise ValueError(f"Unknown catch-up policy: {mode}")
+        self.mode = mode
+        self.window = window_minutes * 60
+        self.max_age = max_age_minutes * 60
+
+    def plan(self, missed, now):
+        """Split missed (message_id, send_at) pairs into (send_now, spread, dropped)
+
+        spread holds (message_id, new_send_at) pairs; the other two hold ids.
+        """
+        if self.mode == CATCHUP_SPREAD and missed:
+            step = self.window / len(missed)
+            return [], [(message_id, now + i * step) for i, (message_id, _) in enumerate(missed)], []
+        if self.mode == CATCHUP_DROP:
+            dropped = [message_id for message_id, send_at in missed if now - send_at > self.max_age]
+            keep = [message_id for message_id, send_at in missed if now - send_at <= self.max_age]
+            return keep, [], dropped
+        return [message_id for message_id, _ in missed], [], []
+
+
+def recover_scheduled(outbox, scheduler, callback, policy=None, now=None):
+    """Re-register pending outbox messages with the scheduler after a restart
+
+    callback(message_id) is what the scheduler runs when each job comes
+    due.  Messages to be sent right away are left due in the outbox so the
+    caller can drain them in batches.
+    """
+    policy = policy or CatchupPolicy()
+    now = time.time() if now is None else now
+
+    outbox.requeue_expired()
+    scheduled = []
+    missed = []
+    recipients = {}
+    for message_id, recipient, send_at in outbox.pending_schedule():
+        if send_at > now:
+            scheduler.schedule(send_at, callback, message_id, job_id=message_id)
+            scheduled.append((message_id, recipient, send_at))
+        else:
+            missed.append((message_id, send_at))
+            recipients[message_id] = recipient
+
+    send_now, spread, dropped = policy.plan(missed, now)
+    if spread:
+        outbox.reschedule(spread)
+        for message_id, send_at in spread:
+            scheduler.schedule(send_at, callback, message_id, job_id=message_id)
+            scheduled.append((message_id, recipients[message_id], send_at))
+    if dropped:
+        outbox.drop(dropped, "Missed its scheduled time while the app was closed")
+
+    return RecoveryResult(scheduled, len(send_now), len(dropped))
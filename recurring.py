@@ -0,0 +1,102 @@
+"""Recurring messages driven by cron expressions
+
+Each recurring message has exactly one entry in the scheduler's heap, at
+its next fire time, and the same time is kept in an indexed column of the
+outbox.  When it fires, one occurrence is queued in the outbox and the
+next fire time is computed from the cron expression and re-armed, so
+tens of thousands of recurring reminders never need a scan to find the
+due ones.
+"""
+
+from datetime import datetime
+import time
+
+import cron
+from recovery import CatchupPolicy
+
+
+class RecurringSchedules:
+    """Arm recurring outbox messages in the shared scheduler
+
+    send_callback(message_id) sends one queued occurrence; it runs on a
+    scheduler worker thread.
+    """
+
+    def __init__(self, outbox, scheduler, send_callback):
+        self.outbox = outbox
+        self.scheduler = scheduler
+        self.send_callback = send_callback
+
+    @staticmethod
+    def job_id(recurring_id):
+        """Scheduler job id for a recurring message (kept apart from outbox message ids)"""
+        return ("recurring", recurring_id)
+
+    @staticmethod
+    def next_fire(expression, after):
+        """Return the next fire timestamp strictly after the given timestamp"""
+        return cron.parse(expression).next_after(datetime.fromtimestamp(after)).timestamp()
+
+    def add(self, recipient, body, expression, from_number=None, now=None):
+        """Store and arm a recurring message; return (recurring_id, first fire timestamp)
+
+        Raises cron.CronError for an invalid expression.
+        """
+        now = time.time() if now is None else now
+        fire_at = self.next_fire(expression, now)
+        recurring_id = self.outbox.add_recurring(recipient, body, expression, fire_at, from_number)
+        self._arm(recurring_id, expression, fire_at)
+        return recurring_id, fire_at
+
+    def cancel(self, recurring_id):
+        """Stop a recurring message; return True if it was active"""
+        self.scheduler.cancel(self.job_id(recurring_id))
+        return self.outbox.cancel_recurring(recurring_id)
+
+    def restore(self, policy=None, now=None):
+        """Re-arm every active recurring message after a restart
+
+        An occurrence missed while the app was closed is sent once (not once
+        per missed occurrence), subject to the catch-up policy.  Returns the
+        list of restored RecurringMessage rows.
+        """
+        policy = policy or CatchupPolicy()
+        now = time.time() if now is None else now
+        rows = self.outbox.active_recurring()
+        missed = {}
+
+        for row in rows:
+            if row.next_fire_at > now:
+                self._arm(row.id, row.expression, row.next_fire_at)
+            else:
+                missed[row.id] = row
+
+        send_now, spread, dropped = policy.plan(
+            [(row.id, row.next_fire_at) for row in missed.values()], now)
+        for recurring_id in send_now:
+            row = missed[recurring_id]
+            self._arm(row.id, row.expression, row.next_fire_at, due=now)
+        for recurring_id, due in spread:
+            row = missed[recurring_id]
+            self._arm(row.id, row.expression, row.next_fire_at, due=due)
+        for recurring_id in dropped:
+            row = missed[recurring_id]
+            next_fire_at = self.next_fire(row.expression, now)
+            self.outbox.skip_recurring(row.id, row.next_fire_at, next_fire_at)
+            self._arm(row.id, row.expression, next_fire_at)
+        return rows
+
+    def _arm(self, recurring_id, expression, fire_at, due=None):
+        self.scheduler.schedule(fire_at if due is None else due, self._fire,
+                                recurring_id, expression, fire_at,
+                                job_id=self.job_id(recurring_id))
+
+    def _fire(self, recurring_id, expression, fire_at):
+        # Compute from whichever is later so occurrences missed while
+        # catching up are skipped rather than replayed one by one
+        next_fire_at = self.next_fire(expression, max(fire_at, time.time()))
+        message_id = self.outbox.record_recurring_fire(recurring_id, fire_at, next_fire_at)
+        if message_id is None:
+            return  # cancelled, or this occurrence was already queued
+        self._arm(recurring_id, expression, next_fire_at)
+        self.send_callback(message_id)
@@ -0,0 +1,169 @@
+"""Retry failed sends with exponential backoff and full jitter
+
+Errors are sorted into retryable (throttling, Twilio 5xx, network
+problems) and permanent (invalid numbers, auth failures, other 4xx).
+Permanent errors are raised straight away; retryable ones are retried
+until the attempt limit or the per-message deadline runs out.
+"""
+
+import asyncio
+import os
+import random
+import time
+
+from metrics import RETRIES
+from rate_limiter import THROTTLE_CODES
+
+RETRYABLE = "retryable"
+PERMANENT = "permanent"
+
+# HTTP statuses worth another attempt
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Twilio error codes worth another attempt
+RETRYABLE_CODES = THROTTLE_CODES | {
+    20500,  # Internal server error
+    20503,  # Service unavailable
+}
+
+# Twilio error codes that will never succeed on retry
+PERMANENT_CODES = {
+    20003,  # Authentication failed
+    20404,  # Resource not found
+    21211,  # Invalid 'To' phone number
+    21212,  # Invalid 'From' phone number
+    21408,  # Permission to send to this region is not enabled
+    21610,  # Recipient has unsubscribed
+    21614,  # 'To' number is not a valid mobile number
+    63007,  # No WhatsApp channel found for the 'From' address
+}
+
+# Maximum attempts per message, including the first one
+DEFAULT_MAX_ATTEMPTS = int(os.getenv("SEND_MAX_ATTEMPTS", "5"))
+
+# Give up on a message this many seconds after its first attempt
+DEFAULT_DEADLINE = float(os.getenv("SEND_RETRY_DEADLINE", "120"))
+
+
+def _is_network_error(error):
+    if isinstance(error, (ConnectionError, TimeoutError, asyncio.TimeoutError)):
+        return True
+    try:
+        import requests
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return True
+    except ImportError:
+        pass
+    try:
+        import aiohttp
+        if isinstance(error, aiohttp.ClientConnectionError):
+            return True
+    except ImportError:
+        pass
+    return False
+
+
+def _is_connect_error(error):
+    # Failed before the request was written, so it cannot have been delivered
+    try:
+        import requests
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+    except ImportError:
+        pass
+    try:
+        import aiohttp
+        if isinstance(error, aiohttp.ClientConnectorError):
+            return True
+    except ImportError:
+        pass
+    return isinstance(error, ConnectionRefusedError)
+
+
+def may_have_been_sent(error):
+    """Return True if a failed create call may still have created the message
+
+    A read timeout, a dropped connection or a 5xx can hide a request Twilio
+    accepted; throttling, other 4xx and connect failures cannot.
+    """
+    status = getattr(error, "status", None)
+    if status is not None:
+        return status >= 500
+    return _is_network_error(error) and not _is_connect_error(error)
+
+
+def classify_error(error):
+    """Return RETRYABLE or PERMANENT for an exception raised by a send"""
+    code = getattr(error, "code", None)
+    status = getattr(error, "status", None)
+
+    if code in PERMANENT_CODES:
+        return PERMANENT
+    if code in RETRYABLE_CODES or status in RETRYABLE_STATUSES:
+        return RETRYABLE
+    if status is not None:
+        # Any other API error (mostly 4xx validation errors) is final
+        return PERMANENT
+    if _is_network_error(error):
+        return RETRYABLE
+    return PERMANENT
+
+
+class RetryPolicy:
+    """How many times, and for how long, to retry a retryable failure"""
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS, base_delay=0.5, max_delay=30.0,
+                 deadline=DEFAULT_DEADLINE):
+        self.max_attempts = max(1, int(max_attempts))
+        self.base_delay = float(base_delay)
+        self.max_delay = float(max_delay)
+        self.deadline = float(deadline)
+
+    def backoff(self, attempt):
+        """Full-jitter delay before the given retry (1 for the first retry)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def next_delay(self, error, attempt, started):
+        """Return the delay before the next attempt, or None to give up"""
+        if attempt >= self.max_attempts or classify_error(error) == PERMANENT:
+            return None
+        remaining = self.deadline - (time.monotonic() - started)
+        delay = self.backoff(attempt)
+        if delay >= remaining:
+            return None
+        return delay
+
+
+def call_with_retry(policy, func, *args, **kwargs):
+    """Call func, retrying retryable failures according to the policy
+
+    The last error is re-raised once the policy gives up.
+    """
+    started = time.monotonic()
+    attempt = 1
+    while True:
+        try:
+            return func(*args, **kwargs)
+        except Exception as e:
+            delay = policy.next_delay(e, attempt, started)
+            if delay is None:
+                raise
+        RETRIES.inc()
+        time.sleep(delay)
+        attempt += 1
+
+
+async def call_with_retry_async(policy, func, *args, **kwargs):
+    """Async counterpart of call_with_retry for coroutine functions"""
+    started = time.monotonic()
+    attempt = 1
+    while True:
+        try:
+            return await func(*args, **kwargs)
+        except Exception as e:
+            delay = policy.next_delay(e, attempt, started)
+            if delay is None:
+                raise
+        RETRIES.inc()
+        await asyncio.sleep(delay)
+        attempt += 1
@@ -0,0 +1,148 @@
+"""Single-thread scheduler for delayed messages
+
+Due times live in a min-heap watched by one timer thread, so scheduling
+100k messages costs one heap entry each instead of one sleeping thread
+each.  When a job comes due its callback is handed to a small worker
+pool, so a slow send never delays the next job's timer.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from metrics import SCHEDULER_LATENESS
+from profiling import span
+
+# Worker threads that run due callbacks
+DEFAULT_SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "4"))
+
+# Longest single wait, so wall-clock changes (sleep, NTP) are noticed
+MAX_WAIT = 60.0
+
+
+class Scheduler:
+    """Run callbacks at wall-clock due times from one timer thread"""
+
+    def __init__(self, max_workers=DEFAULT_SCHEDULER_WORKERS):
+        self._heap = []
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._running = 0
+        self._stopped = False
+        self._executor = ThreadPoolExecutor(max_workers=max_workers,
+                                            thread_name_prefix="scheduler")
+        self._thread = threading.Thread(target=self._run, name="scheduler-timer", daemon=True)
+        self._thread.start()
+
+    def schedule(self, due, callback, *args, job_id=None):
+        """Run callback(*args) at the given time.time() timestamp and return the job id
+
+        Passing an existing job_id replaces that job.  Job ids can be any
+        hashable value.
+        """
+        with self._cond:
+            if job_id is None:
+                job_id = next(self._ids)
+            # The sequence number breaks ties, so job ids never need to be comparable
+            seq = next(self._seq)
+            self._jobs[job_id] = (due, seq, callback, args)
+            heapq.heappush(self._heap, (due, seq, job_id))
+            if self._heap[0][1] == seq:
+                self._cond.notify_all()
+        return job_id
+
+    def cancel(self, job_id):
+        """Cancel a job that has not fired yet; return True if it was pending"""
+        with self._cond:
+            # The heap entry is skipped lazily when it reaches the top
+            removed = self._jobs.pop(job_id, None) is not None
+            self._cond.notify_all()
+            return removed
+
+    def pending(self):
+        """Return {job_id: due} for every job that has not fired yet"""
+        with self._cond:
+            return {job_id: job[0] for job_id, job in self._jobs.items()}
+
+    def pending_count(self):
+        """Return how many jobs have not fired yet"""
+        with self._cond:
+            return len(self._jobs)
+
+    def next_due(self):
+        """Return the earliest due time, or None when nothing is scheduled"""
+        job = self.peek()
+        return job[0] if job else None
+
+    def peek(self):
+        """Return (due, job_id) of the next job to fire, or None when nothing is scheduled"""
+        with self._cond:
+            self._discard_stale()
+            if not self._heap:
+                return None
+            due, _, job_id = self._heap[0]
+            return due, job_id
+
+    def join(self, timeout=None):
+        """Wait until every scheduled job has fired and finished; return True if they did"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while self._jobs or self._running:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def stop(self, wait=True):
+        """Stop the timer thread; jobs that have not fired are discarded"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._executor.shutdown(wait=wait)
+
+    def _discard_stale(self):
+        # Drop heap entries for cancelled or rescheduled jobs
+        while self._heap:
+            _, seq, job_id = self._heap[0]
+            job = self._jobs.get(job_id)
+            if job is not None and job[1] == seq:
+                return
+            heapq.heappop(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    self._discard_stale()
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due, _, job_id = self._heap[0]
+                    delay = due - time.time()
+                    if delay > 0:
+                        self._cond.wait(min(delay, MAX_WAIT))
+                        continue
+                    heapq.heappop(self._heap)
+                    _, _, callback, args = self._jobs.pop(job_id)
+                    self._running += 1
+                    break
+            self._executor.submit(self._fire, due, callback, args)
+
+    def _fire(self, due, callback, args):
+        # Includes time waiting for a free worker, not just timer wake-up delay
+        SCHEDULER_LATENESS.observe(max(0.0, time.time() - due))
+        try:
+            with span("scheduler.job"):
+                callback(*args)
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._cond.notify_all()
@@ -0,0 +1,181 @@
+"""Pool of WhatsApp sender numbers with load balancing
+
+Each sender number has its own Twilio throughput limit, so spreading
+traffic over several senders multiplies total throughput.  New recipients
+go to the least-loaded sender (or by smooth weighted round-robin), and a
+recipient keeps the same sender afterwards so a conversation stays on one
+number.
+
+Senders are configured as a comma-separated list with optional weights:
+
+    WHATSAPP_SENDERS=+14155238886:2,+14155550100,+14155550101
+"""
+
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+import os
+import threading
+import time
+
+from messaging import SANDBOX_NUMBER
+
+LEAST_LOADED = "least_loaded"
+WEIGHTED = "weighted"
+
+# Sender numbers, each optionally followed by :weight
+DEFAULT_SENDERS = os.getenv("WHATSAPP_SENDERS", SANDBOX_NUMBER)
+
+# How a new recipient's sender is chosen
+DEFAULT_STRATEGY = os.getenv("SENDER_STRATEGY", LEAST_LOADED)
+
+# Recipients whose sender assignment is remembered (least recently used are forgotten)
+DEFAULT_STICKY_SIZE = int(os.getenv("SENDER_STICKY_SIZE", "100000"))
+
+# Window over which each sender's send rate is measured
+RATE_WINDOW = 60.0
+
+
+def parse_senders(text):
+    """Parse '+1415...:2,+1415...' into a list of (number, weight) pairs"""
+    senders = []
+    for item in text.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        number, _, weight = item.partition(":")
+        weight = float(weight) if weight else 1.0
+        if weight <= 0:
+            raise ValueError(f"Sender weight must be positive: {item}")
+        senders.append((number.strip(), weight))
+    if not senders:
+        raise ValueError("No sender numbers configured")
+    return senders
+
+
+class _SenderState:
+    """Load and rate bookkeeping for one sender number"""
+
+    def __init__(self, number, weight):
+        self.number = number
+        self.weight = weight
+        self.in_flight = 0
+        self.sent = 0
+        self.failed = 0
+        self.current_weight = 0.0  # smooth weighted round-robin state
+        self.recent = deque()  # completion times within RATE_WINDOW
+
+    def rate(self, now):
+        while self.recent and self.recent[0] < now - RATE_WINDOW:
+            self.recent.popleft()
+        return len(self.recent) / RATE_WINDOW
+
+
+class SenderPool:
+    """Pick a sender number per recipient and track each sender's load
+
+    Thread-safe; the bookkeeping is a few dictionary operations under one
+    lock, so it is cheap next to the HTTP request it guards.  When a rate
+    limiter is given, least-loaded selection also accounts for each
+    sender's current allowed rate.
+    """
+
+    def __init__(self, senders=None, strategy=DEFAULT_STRATEGY, sticky=True,
+                 sticky_size=DEFAULT_STICKY_SIZE, rate_limiter=None):
+        if senders is None or isinstance(senders, str):
+            senders = parse_senders(senders or DEFAULT_SENDERS)
+        if strategy not in (LEAST_LOADED, WEIGHTED):
+            raise ValueError(f"Unknown sender strategy: {strategy}")
+        self._senders = [_SenderState(number, weight)
+                         for number, weight in ((s, 1.0) if isinstance(s, str) else s
+                                                for s in senders)]
+        self._by_number = {state.number: state for state in self._senders}
+        self._total_weight = sum(state.weight for state in self._senders)
+        self.strategy = strategy
+        self.sticky = sticky
+        self.sticky_size = max(1, int(sticky_size))
+        self.rate_limiter = rate_limiter
+        self._assigned = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def numbers(self):
+        """Configured sender numbers, in order"""
+        return [state.number for state in self._senders]
+
+    def select(self, recipient):
+        """Return the sender number to use for a recipient"""
+        with self._lock:
+            if self.sticky:
+                number = self._assigned.get(recipient)
+                if number is not None:
+                    self._assigned.move_to_end(recipient)
+                    return number
+            if len(self._senders) == 1:
+                state = self._senders[0]
+            elif self.strategy == WEIGHTED:
+                state = self._next_weighted()
+            else:
+                state = min(self._senders, key=self._load)
+            if self.sticky:
+                self._assigned[recipient] = state.number
+                if len(self._assigned) > self.sticky_size:
+                    self._assigned.popitem(last=False)
+            return state.number
+
+    def _load(self, state):
+        capacity = state.weight
+        if self.rate_limiter is not None:
+            capacity *= self.rate_limiter.current_rate(state.number)
+        return (state.in_flight + 1) / capacity
+
+    def _next_weighted(self):
+        # nginx-style smooth weighted round-robin: evenly interleaves senders
+        best = None
+        for state in self._senders:
+            state.current_weight += state.weight
+            if best is None or state.current_weight > best.current_weight:
+                best = state
+        best.current_weight -= self._total_weight
+        return best
+
+    def begin(self, number):
+        """Record that a send from this sender has started"""
+        with self._lock:
+            state = self._by_number.get(number)
+            if state is not None:
+                state.in_flight += 1
+
+    def finish(self, number, success):
+        """Record that a send from this sender has finished"""
+        with self._lock:
+            state = self._by_number.get(number)
+            if state is None:
+                return
+            state.in_flight -= 1
+            if success:
+                state.sent += 1
+                state.recent.append(time.monotonic())
+            else:
+                state.failed += 1
+
+    @contextmanager
+    def sending(self, number):
+        """Track one send from a sender for the duration of the block"""
+        self.begin(number)
+        success = False
+        try:
+            yield
+            success = True
+        finally:
+            self.finish(number, success)
+
+    def stats(self):
+        """Return {number: {weight, in_flight, sent, failed, rate}} with rate in messages/second"""
+        now = time.monotonic()
+        with self._lock:
+            return {state.number: {"weight": state.weight,
+                                   "in_flight": state.in_flight,
+                                   "sent": state.sent,
+                                   "failed": state.failed,
+                                   "rate": state.rate(now)}
+                    for state in self._senders}
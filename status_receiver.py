@@ -0,0 +1,193 @@
+"""Embedded receiver for Twilio delivery status callbacks
+
+When STATUS_CALLBACK_URL is set, every message is created with that URL
+as its ``status_callback`` and Twilio POSTs each status change (queued,
+sent, delivered, read, failed, ...) to it.  Point the URL at this
+receiver, directly or through a tunnel such as ngrok:
+
+    STATUS_CALLBACK_URL=https://example.ngrok.app/status
+    STATUS_CALLBACK_PORT=8080
+
+Request threads only parse the form and enqueue the update, so a burst
+of callbacks never waits on the database; one writer thread stores the
+updates in the outbox in batches.  When the receiver runs outside the
+CLI/GUI (for example next to worker.py), start it on its own:
+
+    python status_receiver.py
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+import os
+import queue
+import threading
+import time
+
+import dotenv
+
+# Load environment variables from .env file (before outbox and the settings below read them)
+dotenv.load_dotenv()
+
+from outbox import Outbox
+
+# Public URL Twilio posts status callbacks to (no callbacks when unset)
+STATUS_CALLBACK_URL = os.getenv("STATUS_CALLBACK_URL", "")
+
+# Local address the receiver listens on
+DEFAULT_HOST = os.getenv("STATUS_CALLBACK_HOST", "0.0.0.0")
+DEFAULT_PORT = int(os.getenv("STATUS_CALLBACK_PORT", "8080"))
+
+# Most updates written per transaction, and longest wait before a partial batch is written
+DEFAULT_BATCH_SIZE = int(os.getenv("STATUS_BATCH_SIZE", "1000"))
+DEFAULT_FLUSH_INTERVAL = float(os.getenv("STATUS_FLUSH_INTERVAL", "0.5"))
+
+
+class _CallbackHandler(BaseHTTPRequestHandler):
+    # Keep-alive lets Twilio reuse connections during bursts
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        receiver = self.server.receiver
+        if urlsplit(self.path).path != receiver.path:
+            self._reply(404)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        params = dict(parse_qsl(self.rfile.read(length).decode("utf-8")))
+        if not receiver.is_authentic(params, self.headers.get("X-Twilio-Signature", "")):
+            self._reply(403)
+            return
+        sid = params.get("MessageSid")
+        status = params.get("MessageStatus")
+        if not (sid and status):
+            self._reply(400)
+            return
+        receiver.submit(sid, status, params.get("ErrorCode"))
+        self._reply(204)
+
+    def _reply(self, code):
+        self.send_response(code)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass  # one line per callback would swamp the console during bursts
+
+
+class StatusReceiver:
+    """HTTP endpoint for StatusCallback posts, writing updates to the outbox in batches
+
+    With an auth token, callbacks are checked against Twilio's
+    X-Twilio-Signature header using callback_url, so that must be the
+    exact public URL Twilio posts to.
+    """
+
+    def __init__(self, outbox, callback_url=STATUS_CALLBACK_URL, host=DEFAULT_HOST,
+                 port=DEFAULT_PORT, auth_token=None, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.outbox = outbox
+        self.callback_url = callback_url
+        self.path = urlsplit(callback_url).path or "/"
+        self.host = host
+        self.port = port
+        self.batch_size = max(1, int(batch_size))
+        self.flush_interval = flush_interval
+        self.received = 0
+        self._validator = None
+        if auth_token:
+            from twilio.request_validator import RequestValidator
+            self._validator = RequestValidator(auth_token)
+        self._updates = queue.SimpleQueue()
+        self._server = None
+        self._stopped = threading.Event()
+        self._threads = []
+
+    def is_authentic(self, params, signature):
+        """Return True if the callback was signed by Twilio (always True without a token)"""
+        if self._validator is None:
+            return True
+        return self._validator.validate(self.callback_url, params, signature)
+
+    def submit(self, sid, status, error_code=None):
+        """Queue one status update for the writer thread"""
+        self.received += 1
+        self._updates.put((sid, status, error_code, time.time()))
+
+    def start(self):
+        """Start listening; raises OSError if the port is already taken"""
+        self._server = ThreadingHTTPServer((self.host, self.port), _CallbackHandler)
+        self._server.daemon_threads = True
+        self._server.receiver = self
+        self.port = self._server.server_address[1]
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, name="status-http", daemon=True),
+            threading.Thread(target=self._write, name="status-writer", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        """Stop listening and write any updates still queued"""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+        self._stopped.set()
+        for thread in self._threads:
+            thread.join()
+
+    def _write(self):
+        while True:
+            try:
+                batch = [self._updates.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                if self._stopped.is_set():
+                    return
+                continue
+            # Take whatever else has arrived, up to one batch
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._updates.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.outbox.record_statuses(batch)
+            except Exception as e:
+                print(f"Failed to store {len(batch)} status update(s): {e}")
+
+
+def start_status_receiver(outbox, auth_token=None):
+    """Start a receiver if STATUS_CALLBACK_URL is set; return it, or None
+
+    A port already in use is reported and skipped, on the assumption that
+    another process (such as a standalone receiver) is handling callbacks.
+    """
+    if not STATUS_CALLBACK_URL:
+        return None
+    try:
+        return StatusReceiver(outbox, auth_token=auth_token).start()
+    except OSError as e:
+        print(f"Status callback receiver not started on port {DEFAULT_PORT}: {e}")
+        return None
+
+
+def main():
+    if not STATUS_CALLBACK_URL:
+        print("Set STATUS_CALLBACK_URL to the public URL Twilio should post status callbacks to.")
+        return
+    outbox = Outbox()
+    receiver = StatusReceiver(outbox, auth_token=os.getenv("AUTH_TOKEN")).start()
+    print(f"Receiving status callbacks for {STATUS_CALLBACK_URL} on port {receiver.port}; "
+          "press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        receiver.stop()
+        outbox.close()
+    print(f"Stored {receiver.received} status update(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Opt-out suppression list checked before every send
+
+Numbers that opted out are kept in an in-memory set backed by a plain
+text file (one E.164 number per line, ``#`` starts a comment), so every
+check is a single O(1) lookup.  New opt-outs are appended to the file
+immediately.
+
+A Bloom filter can also sit in front of the set once the list reaches
+SUPPRESSION_BLOOM_THRESHOLD entries: a miss in the filter answers "not
+suppressed" without consulting the set.  It is off by default, since in
+CPython a set lookup is already cheaper than the filter's bit probes.
+"""
+
+import math
+import os
+import threading
+
+from phones import normalize
+
+# Backing file with one opted-out number per line
+DEFAULT_SUPPRESSION_PATH = os.getenv("SUPPRESSION_PATH", "suppressed.txt")
+
+# List size from which a Bloom filter is put in front of the set (0 = never)
+DEFAULT_BLOOM_THRESHOLD = int(os.getenv("SUPPRESSION_BLOOM_THRESHOLD", "0"))
+
+# Twilio's error code for a recipient who has unsubscribed
+UNSUBSCRIBED_CODE = 21610
+
+
+class SuppressedError(Exception):
+    """Raised instead of sending to a number on the suppression list"""
+
+    code = UNSUBSCRIBED_CODE
+
+    def __init__(self, recipient):
+        super().__init__(f"{recipient} has opted out of messages")
+        self.recipient = recipient
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings
+
+    Uses two hashes of each item to derive k bit positions (double
+    hashing).  Python's str hash is cached on the string object, so checks
+    cost no rehashing of the recipient.
+    """
+
+    def __init__(self, capacity, error_rate=0.001):
+        capacity = max(1, int(capacity))
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        h1 = hash(item)
+        h2 = hash((item, 0x9E3779B9)) | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, item):
+        bits = self._bits
+        for position in self._positions(item):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item):
+        bits = self._bits
+        for position in self._positions(item):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class SuppressionList:
+    """Thread-safe opt-out set with an append-only backing file"""
+
+    def __init__(self, path=DEFAULT_SUPPRESSION_PATH, bloom_threshold=DEFAULT_BLOOM_THRESHOLD):
+        self.path = path
+        self.bloom_threshold = bloom_threshold
+        self._lock = threading.Lock()
+        self._numbers = set()
+        self._bloom = None
+        self.load()
+
+    def load(self):
+        """(Re)read the backing file; a missing file means an empty list"""
+        numbers = set()
+        if self.path and os.path.exists(self.path):
+            with open(self.path, encoding="utf-8") as f:
+                entries = (line.split("#", 1)[0].strip() for line in f)
+                # Stored in E.164 form, so "+1 415 555 0100" matches +14155550100;
+                # lines already written that way (as add() writes them) skip normalize
+                numbers = {entry if entry[0] == "+" and entry[1:].isdecimal()
+                           else normalize(entry) or entry
+                           for entry in entries if entry}
+        bloom = None
+        if self.bloom_threshold and len(numbers) >= self.bloom_threshold:
+            bloom = BloomFilter(len(numbers) * 2)
+            for number in numbers:
+                bloom.add(number)
+        with self._lock:
+            self._numbers = numbers
+            self._bloom = bloom
+        return len(numbers)
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def __contains__(self, recipient):
+        bloom = self._bloom
+        if bloom is not None and recipient not in bloom:
+            return False
+        return recipient in self._numbers
+
+    def check(self, recipient):
+        """Raise SuppressedError if the recipient has opted out
+
+        The recipient is normalized first, so "whatsapp:+14155550100" or
+        " +14155550100" is caught like +14155550100 on every send path.
+        """
+        if (normalize(recipient) or recipient.strip()) in self:
+            raise SuppressedError(recipient)
+
+    def add(self, recipient):
+        """Suppress a number from now on; return False if it already was"""
+        number = normalize(recipient) or recipient.strip()
+        with self._lock:
+            if number in self._numbers:
+                return False
+            self._numbers.add(number)
+            if self._bloom is not None:
+                self._bloom.add(number)
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(number + "\n")
+            return True
+
+    def remove(self, recipient):
+        """Allow messages to a number again; return False if it was not suppressed"""
+        number = normalize(recipient) or recipient.strip()
+        with self._lock:
+            if number not in self._numbers:
+                return False
+            self._numbers.discard(number)
+            if self.path:
+                # Rewritten atomically so a crash never leaves a partial list
+                temp_path = self.path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    f.writelines(n + "\n" for n in self._numbers)
+                os.replace(temp_path, self.path)
+        # The Bloom filter cannot forget a number; rebuild it from the file
+        if self._bloom is not None:
+            self.load()
+        return True
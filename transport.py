@@ -0,0 +1,115 @@
+"""Pooled, tunable HTTP transport for the Twilio Client
+
+Twilio's default TwilioHttpClient mounts a small connection pool and
+exposes no keep-alive or timeout tuning.  The factories here build a
+Client on one shared requests.Session whose pool is sized to the send
+concurrency, so concurrent senders reuse TLS connections instead of
+paying for a new handshake on every message.
+"""
+
+import os
+
+import profiling
+
+# Default number of concurrent sends (bulk_sender and worker pools)
+DEFAULT_MAX_WORKERS = int(os.getenv("BULK_MAX_WORKERS", "16"))
+
+# Connections kept open to the Twilio API; match this to send concurrency
+DEFAULT_POOL_SIZE = int(os.getenv("TWILIO_POOL_SIZE", str(DEFAULT_MAX_WORKERS)))
+
+# Seconds to wait for a connection, and for a response once connected
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("TWILIO_CONNECT_TIMEOUT", "5"))
+DEFAULT_READ_TIMEOUT = float(os.getenv("TWILIO_READ_TIMEOUT", "30"))
+
+# Seconds an idle keep-alive connection stays open (async transport)
+DEFAULT_KEEPALIVE = float(os.getenv("TWILIO_KEEPALIVE", "60"))
+
+# Send API calls somewhere other than https://api.twilio.com, such as fake_twilio.py
+DEFAULT_API_BASE_URL = os.getenv("TWILIO_API_BASE_URL", "")
+
+
+def create_session(pool_size=DEFAULT_POOL_SIZE):
+    """Return a keep-alive requests.Session with a pool of pool_size connections
+
+    pool_block makes extra threads wait for a free connection rather than
+    opening (and then discarding) short-lived ones.
+    """
+    from requests import Session
+    from requests.adapters import HTTPAdapter
+
+    session = Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=True,
+                          max_retries=0)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+
+def create_http_client(pool_size=DEFAULT_POOL_SIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                       read_timeout=DEFAULT_READ_TIMEOUT, session=None):
+    """Return a TwilioHttpClient that sends through a shared, pooled session"""
+    from twilio.http.http_client import TwilioHttpClient
+
+    # TwilioHttpClient only validates a single number, so the
+    # (connect, read) tuple is set after construction
+    http_client = TwilioHttpClient(pool_connections=True)
+    http_client.session = session if session is not None else create_session(pool_size)
+    http_client.timeout = (connect_timeout, read_timeout)
+    return http_client
+
+
+def build_client(account_sid, auth_token, pool_size=DEFAULT_POOL_SIZE,
+                 connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                 session=None, api_base_url=DEFAULT_API_BASE_URL):
+    """Build a Twilio Client on the pooled transport"""
+    from twilio.rest import Client
+
+    http_client = create_http_client(pool_size, connect_timeout, read_timeout, session)
+    return _point_at(Client(account_sid, auth_token, http_client=http_client), api_base_url)
+
+
+def _point_at(client, api_base_url):
+    # The Messages API lives on the core "api" domain; its base URL is the only host setting
+    if api_base_url:
+        client.api.base_url = api_base_url.rstrip("/")
+    return client
+
+
+def build_async_client(account_sid, auth_token, pool_size=DEFAULT_POOL_SIZE,
+                       connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+                       keepalive=DEFAULT_KEEPALIVE, api_base_url=DEFAULT_API_BASE_URL):
+    """Build a Twilio Client on an aiohttp session with a sized, keep-alive connector
+
+    Must be called from inside a running event loop, because the aiohttp
+    session is bound to the loop that creates it.
+    """
+    import aiohttp
+    from twilio.rest import Client
+    from twilio.http.async_http_client import AsyncTwilioHttpClient
+
+    http_client = AsyncTwilioHttpClient(pool_connections=False)
+    session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=keepalive),
+        trace_configs=profiling.aiohttp_trace_configs())
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    http_client.session = _DefaultTimeoutSession(session, timeout)
+    return _point_at(Client(account_sid, auth_token, http_client=http_client), api_base_url)
+
+
+class _DefaultTimeoutSession:
+    """Wrap an aiohttp session so requests without a timeout get the default one
+
+    AsyncTwilioHttpClient passes timeout=None explicitly, which aiohttp
+    treats as "no timeout" rather than "use the session default".
+    """
+
+    def __init__(self, session, timeout):
+        self._session = session
+        self._timeout = timeout
+
+    def request(self, timeout=None, **kwargs):
+        return self._session.request(timeout=timeout or self._timeout, **kwargs)
+
+    async def close(self):
+        await self._session.close()
@@ -0,0 +1,158 @@
+"""Sender worker processes that drain the shared outbox
+
+The CLI and GUI store every message in the outbox before sending it, so
+extra send capacity is just more processes draining the same database:
+
+    python worker.py                  # one worker process
+    python worker.py --processes 4    # four worker processes on this host
+
+Workers on other hosts can share the database file too (set
+OUTBOX_JOURNAL_MODE=DELETE there, since WAL only works on one host).
+Every claim is a lease, so a crashed worker's messages go back to the
+queue once its lease runs out, and no two workers hold the same message.
+
+Each process gets its own Twilio client and connection pool; the
+per-sender rate limit is split evenly between the local processes.
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import threading
+
+import dotenv
+
+# Load environment variables from .env file (before the modules below read their settings)
+dotenv.load_dotenv()
+
+from bulk_sender import BulkSender
+from metrics import DEFAULT_METRICS_PORT, start_metrics_server
+import profiling
+from outbox import Outbox
+from rate_limiter import AdaptiveRateLimiter, DEFAULT_RATE, DEFAULT_MAX_RATE
+from retry import RetryPolicy
+from sender_pool import SenderPool
+from suppression import SuppressionList
+from status_receiver import STATUS_CALLBACK_URL
+from transport import DEFAULT_MAX_WORKERS, build_client
+
+# Worker processes started by default
+DEFAULT_WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "1"))
+
+# Seconds an idle worker waits before checking the outbox again
+DEFAULT_POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "1"))
+
+# Messages claimed per lease transaction
+DEFAULT_CLAIM_BATCH = int(os.getenv("WORKER_CLAIM_BATCH", "500"))
+
+
+def claim_until(outbox, stop, batch_size=DEFAULT_CLAIM_BATCH):
+    """Yield due messages batch by batch until the outbox is empty or stop is set
+
+    Checked only between batches, so every claimed message is sent.
+    """
+    while not stop.is_set():
+        batch = outbox.claim(batch_size)
+        if not batch:
+            return
+        yield from batch
+
+
+def run_worker(processes=1, max_workers=DEFAULT_MAX_WORKERS, batch_size=DEFAULT_CLAIM_BATCH,
+               poll_interval=DEFAULT_POLL_INTERVAL, stop=None, metrics_port=DEFAULT_METRICS_PORT,
+               profile=False):
+    """Drain the outbox until stop is set (or SIGINT/SIGTERM in this process)"""
+    if profile:
+        # One report per process when several are running
+        profiling.enable(f"{profiling.DEFAULT_REPORT_PATH}.{os.getpid()}" if processes > 1 else None)
+    stop = stop or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *_: stop.set())
+
+    client = build_client(os.getenv("ACCOUNT_SID"), os.getenv("AUTH_TOKEN"), pool_size=max_workers)
+    # This process's share of each sender's rate limit
+    rate_limiter = AdaptiveRateLimiter(rate=DEFAULT_RATE / processes,
+                                       max_rate=DEFAULT_MAX_RATE / processes)
+    sender = BulkSender(client, max_workers=max_workers, rate_limiter=rate_limiter,
+                        retry_policy=RetryPolicy(),
+                        sender_pool=SenderPool(rate_limiter=rate_limiter),
+                        suppression=SuppressionList(), status_callback=STATUS_CALLBACK_URL)
+    outbox = Outbox()
+    metrics_server = start_metrics_server(outbox, port=metrics_port)
+    name = f"worker {os.getpid()}"
+    print(f"{name}: draining {outbox.path}")
+    if metrics_server is not None:
+        print(f"{name}: metrics on port {metrics_server.port}")
+
+    try:
+        while not stop.is_set():
+            sent = failed = 0
+            for result in sender.send_claimed(outbox, claim_until(outbox, stop, batch_size),
+                                              max_workers):
+                if result.success:
+                    sent += 1
+                else:
+                    failed += 1
+            if sent or failed:
+                print(f"{name}: sent {sent}, failed {failed}")
+            else:
+                stop.wait(poll_interval)
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+        outbox.close()
+        if profile:
+            # Worker processes exit without running atexit handlers
+            profiling.write_report()
+    print(f"{name}: stopped")
+
+
+def run_workers(processes=DEFAULT_WORKER_PROCESSES, max_workers=DEFAULT_MAX_WORKERS,
+                batch_size=DEFAULT_CLAIM_BATCH, poll_interval=DEFAULT_POLL_INTERVAL, profile=False):
+    """Run worker processes until interrupted"""
+    if processes <= 1:
+        run_worker(1, max_workers, batch_size, poll_interval, profile=profile)
+        return
+
+    # Each process serves its own /metrics, on consecutive ports from METRICS_PORT
+    workers = [multiprocessing.Process(target=run_worker, name=f"worker-{i}",
+                                       args=(processes, max_workers, batch_size, poll_interval),
+                                       kwargs={"metrics_port": DEFAULT_METRICS_PORT and DEFAULT_METRICS_PORT + i,
+                                               "profile": profile})
+               for i in range(processes)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        # Ctrl+C also reached the workers; let them finish their current batch
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send queued WhatsApp messages from the outbox")
+    parser.add_argument("--processes", type=int, default=DEFAULT_WORKER_PROCESSES,
+                        help="worker processes to start (default %(default)s)")
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS,
+                        help="concurrent sends per process (default %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_CLAIM_BATCH,
+                        help="messages claimed per batch (default %(default)s)")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_INTERVAL,
+                        help="seconds to wait when the outbox is empty (default %(default)s)")
+    parser.add_argument("--profile", action="store_true", default=profiling.PROFILE_ENABLED,
+                        help="record timing spans and stack samples and write a report at exit")
+    args = parser.parse_args()
+    run_workers(max(1, args.processes), args.max_workers, args.batch_size, args.poll_interval,
+                args.profile)
+
+
+if __name__ == "__main__":
+    main()